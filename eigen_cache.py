@@ -0,0 +1,107 @@
+###############################################
+#
+#    script: eigen_cache.py
+#
+#    Author: Paul Sanders (phs0007@auburn.edu)
+#
+#    Purpose: Keep eigen-spectra on disk so that
+#             changing the broadening or the plot
+#             range does not re-diagonalize
+#
+#    The key is a hash of the assembled matrix
+#    (dense or sparse) and the solver settings.
+#    Entries are .npy files in CACHE_DIR; the least
+#    recently used ones are removed once the cache
+#    grows beyond MAX_BYTES.
+#
+#    Environment: EIGEN_CACHE_DIR  (default .eigen_cache)
+#                 EIGEN_CACHE_MB   (default 1024, 0 disables)
+#
+###############################################
+
+import os
+import hashlib
+import numpy
+import scipy.sparse
+
+CACHE_DIR = os.environ.get("EIGEN_CACHE_DIR", ".eigen_cache")
+MAX_BYTES = int(float(os.environ.get("EIGEN_CACHE_MB", 1024)) * 2**20)
+
+def array_key(array, **settings):
+    digest = hashlib.sha256()
+    if scipy.sparse.issparse(array):
+        array = scipy.sparse.csr_matrix(array)
+        array.sum_duplicates()
+        array.sort_indices()
+        parts = [array.data, array.indices, array.indptr]
+        digest.update(b"csr")
+    else:
+        parts = [numpy.asarray(array)]
+        digest.update(b"dense")
+    digest.update(repr(array.shape).encode())
+    for part in parts:
+        part = numpy.ascontiguousarray(part)
+        digest.update(part.dtype.str.encode())
+        digest.update(memoryview(part).cast("B"))
+    for name in sorted(settings):
+        digest.update("{}={!r};".format(name, settings[name]).encode())
+    return digest.hexdigest()
+
+def cache_path(key, cache_dir=None):
+    return os.path.join(cache_dir or CACHE_DIR, key + ".npy")
+
+def load(key, cache_dir=None):
+    path = cache_path(key, cache_dir)
+    try:
+        values = numpy.load(path)
+    except (IOError, OSError, ValueError):
+        return None
+    try:
+        os.utime(path)  # mark as recently used
+    except OSError:
+        pass  # evicted meanwhile by another process
+    return values
+
+def store(key, values, cache_dir=None, max_bytes=None):
+    if max_bytes is None:
+        max_bytes = MAX_BYTES
+    if max_bytes <= 0:
+        return
+    cache_dir = cache_dir or CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(key, cache_dir)
+    tmpfile = path + ".tmp.npy"
+    numpy.save(tmpfile, values)
+    os.replace(tmpfile, path)
+    evict(cache_dir, max_bytes)
+
+def evict(cache_dir=None, max_bytes=None):
+    if max_bytes is None:
+        max_bytes = MAX_BYTES
+    cache_dir = cache_dir or CACHE_DIR
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".npy") and not name.endswith(".tmp.npy"):
+            stat = os.stat(os.path.join(cache_dir, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+    entries.sort()
+    total = sum(entry[1] for entry in entries)
+    for mtime, size, name in entries:
+        if total <= max_bytes:
+            break
+        os.remove(os.path.join(cache_dir, name))
+        total -= size
+
+def cached_eigvalsh(array, solver, cache_dir=None, max_bytes=None, **settings):
+    # settings are passed to the solver and are part of the key
+    if max_bytes is None:
+        max_bytes = MAX_BYTES
+    if max_bytes <= 0:
+        return solver(array, **settings)
+    name = "{}.{}".format(solver.__module__, solver.__name__)
+    key = array_key(array, solver=name, **settings)
+    eigens = load(key, cache_dir)
+    if eigens is None:
+        eigens = solver(array, **settings)
+        store(key, eigens, cache_dir, max_bytes)
+    return eigens
@@ -6,11 +6,16 @@ import time
 import scipy.linalg
 import matplotlib.pyplot as plt
 
-data = open(sys.argv[1],"r")
-data = data.readlines()
-data = [i.split() for i in data]
-data = [[float(j) for j in i][0] for i in data]
-x = numpy.linspace(1,4096,4096)
+# frequencies from a text file (eigens.out) or a cached .npy spectrum;
+# eigen_cache keeps raw eigenvalues (omega**2), so those are converted
+if sys.argv[1].endswith(".npy"):
+    data = numpy.sqrt(numpy.clip(numpy.load(sys.argv[1]), 0, None))
+else:
+    data = open(sys.argv[1],"r")
+    data = data.readlines()
+    data = [i.split() for i in data]
+    data = [[float(j) for j in i][0] for i in data]
+x = numpy.linspace(1,len(data),len(data))
 plt.plot(x,data)
 plt.show()
 
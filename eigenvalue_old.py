@@ -16,14 +16,33 @@
 import sys
 import numpy
 import scipy.linalg
+import scipy.sparse
 import matplotlib.pyplot as plt
+import dos_broadening
+import eigen_cache
+import kpm_dos
+import sparse_solver
 
 def main():
-    length, array = get_array(sys.argv[1])
-    eigenvalues = eigens(array)
+    # python3 eigenvalue_old.py file [sparse] [kpm]
+    # kpm estimates the DOS from matrix-vector products only
+    options = sys.argv[2:]
+    if "sparse" in options:
+        length, array = sparse_solver.get_sparse_array(sys.argv[1])
+    else:
+        length, array = get_array(sys.argv[1])
+    array = sparse_solver.symmetrize(array, report=True)
     x = numpy.linspace(0,1,1000)
     sigma = 0.001
-    y = rho(x, eigenvalues, sigma, length)
+    if "kpm" in options:
+        # sigma matched at the top of the plot, coarser below it, and
+        # scaled to the normalization of rho()
+        resolution = kpm_dos.frequency_resolution(sigma, x[-1])
+        y = kpm_dos.dos(kpm_dos.as_operator(array), x, resolution=resolution)
+        y = y * dos_broadening.GAUSSIAN_WEIGHT
+    else:
+        eigenvalues = eigens(array)
+        y = rho(x, eigenvalues, sigma, length)
     plt.plot(x,y)
     plt.show()
 
@@ -67,24 +86,28 @@ def get_array(file):
     
 
 def eigens(array):
-    eigens = scipy.linalg.eigvalsh(array)
+    if scipy.sparse.issparse(array):
+        eigens = eigen_cache.cached_eigvalsh(array, sparse_solver.eigvalsh)
+    else:
+        eigens = eigen_cache.cached_eigvalsh(array, scipy.linalg.eigvalsh)
 
-    for i, value in enumerate(eigens):
-        if value < 0:
-             eigens[i] = 0
-    
-    eigens = numpy.sqrt(eigens)
+    # round-off below zero on the acoustic mode; the sum rule itself is
+    # restored by sparse_solver.symmetrize
+    eigens = numpy.sqrt(numpy.clip(eigens, 0, None))
 
     return eigens
 
 def gaussian(x, lam, sigma, N):
     return numpy.exp(-(x - lam)**2/sigma**2)/(sigma*N*numpy.sqrt(2*numpy.pi))
 
-def rho(x, eigenvalues, sigma, N):
-    func = 0
-    for lam in eigenvalues:
-        func = func + gaussian(x, lam, sigma, N)
-    return func
+def rho(x, eigenvalues, sigma, N, method="fft"):
+    # method = "loop" keeps the original per-eigenvalue sum for checking
+    if method == "loop":
+        func = 0
+        for lam in eigenvalues:
+            func = func + gaussian(x, lam, sigma, N)
+        return func
+    return dos_broadening.broaden(x, eigenvalues, sigma, N, method=method)
 
 ##############################################  
 
@@ -29,9 +29,19 @@ import heapq
 import textwrap
 import os
 import fnmatch
+import multiprocessing
+import eigen_cache
 
 def main():
 
+    # non-interactive batch over a whole directory
+    if len(sys.argv) >= 2 and sys.argv[1] == "batch":
+        batchmode()
+        return
+    if len(sys.argv) >= 3 and sys.argv[1] == "jacbench":
+        jacbenchmark()
+        return
+
     # get information from user questions
     sourcemode = initial_configuration()
     path, process, typePorE, Vo, material = display1(sourcemode)
@@ -40,19 +50,87 @@ def main():
     Eoi, Voi, vol, yval, lenvol = getdata(path, typePorE)
 
     # fit parameters
-    param1, Koi = getparams("2nd", typePorE, Vo, vol, yval, Eoi, Voi, 1.5)
-    param2, Koi, Kpoi = getparams("3rd", typePorE, Vo, vol, yval, Eoi, Voi, Koi, 4.0)
-    param3 = getparams("vin", typePorE, Vo, vol, yval, Eoi, Voi, Koi, Kpoi)
-    param4, alpha = getparams("alp", typePorE, Vo, vol, yval, Eoi, Voi, Koi, 7/3)
-    param5 = getparams("abe", typePorE, Vo, vol, yval, Eoi, Voi, Koi, alpha, 0.5 * (alpha + 1))
-    param6 = getparams("meo", typePorE, Vo, vol, yval, Eoi, Voi, Koi, Kpoi)
-    param7 = getparams("kea", typePorE, Vo, vol, yval, Eoi, Voi, Koi, Kpoi, Kpoi)
+    params = fitall(typePorE, Vo, vol, yval, Eoi, Voi, source=path)
 
     # output results
-    output_screen_results(param1, param2, param3, param4, param5, param6, param7, typePorE)
-    yfit = list(output_results(material, lenvol, vol, yval, Vo, param1, param2, param3, param4, param5, param6, param7, typePorE))
+    output_screen_results(*params, typePorE)
+    yfit = list(output_results(material, lenvol, vol, yval, Vo, *params, typePorE))
     #plotting(typePorE, vol, yval, yfit, material)
 
+def fitall(typePorE, Vo, vol, yval, Eoi, Voi, usejac=True, source=None, cache=True):
+    options = dict(usejac=usejac, source=source, cache=cache)
+    param1, Koi = getparams("2nd", typePorE, Vo, vol, yval, Eoi, Voi, 1.5, **options)
+    param2, Koi, Kpoi = getparams("3rd", typePorE, Vo, vol, yval, Eoi, Voi, Koi, 4.0, **options)
+    param3 = getparams("vin", typePorE, Vo, vol, yval, Eoi, Voi, Koi, Kpoi, **options)
+    param4, alpha = getparams("alp", typePorE, Vo, vol, yval, Eoi, Voi, Koi, 7/3, **options)
+    param5 = getparams("abe", typePorE, Vo, vol, yval, Eoi, Voi, Koi, alpha, 0.5 * (alpha + 1), **options)
+    param6 = getparams("meo", typePorE, Vo, vol, yval, Eoi, Voi, Koi, Kpoi, **options)
+    param7 = getparams("kea", typePorE, Vo, vol, yval, Eoi, Voi, Koi, Kpoi, Kpoi, **options)
+    return param1, param2, param3, param4, param5, param6, param7
+
+def jacbenchmark():
+    # python3 equationofstateparams.py jacbench eos.in{E,P}_* [Vo]
+    path = sys.argv[2]
+    typePorE = os.path.basename(path)[6]
+    Vo = float(sys.argv[3]) if len(sys.argv) > 3 else 0
+    Eoi, Voi, vol, yval, lenvol = getdata(path, typePorE)
+    counts = []
+    for usejac in (False, True):
+        fitcounts.clear()
+        fitall(typePorE, Vo, vol, yval, Eoi, Voi, usejac=usejac, cache=False)
+        counts.append(dict(fitcounts))
+    print("eos    nfev (finite diff)   nfev + njev (analytic)")
+    for eos in ["2nd", "3rd", "vin", "alp", "abe", "meo", "kea"]:
+        nodiff = counts[0].get(eos, (0, 0))
+        analytic = counts[1].get(eos, (0, 0))
+        print("{}    {:10d}           {:6d} + {:d}".format(eos, nodiff[0], analytic[0], analytic[1]))
+
+######################################################
+
+def batchmode():
+    # python3 equationofstateparams.py batch [directory] [processes] [Vo]
+    directory = sys.argv[2] if len(sys.argv) > 2 else os.getcwd()
+    processes = int(sys.argv[3]) if len(sys.argv) > 3 and int(sys.argv[3]) > 0 else None
+    Vo = float(sys.argv[4]) if len(sys.argv) > 4 else 0
+    files = sorted(i for i in os.listdir(directory) if fnmatch.fnmatch(i, "eos.in[EP]_*"))
+    if len(files) == 0:
+        sys.exit("We found no eos.in{E,P}_* files to fit!")
+    print("Fitting {} files in {}".format(len(files), directory))
+
+    tasks = [(os.path.join(directory, i), Vo, directory) for i in files]
+    pool = multiprocessing.Pool(processes)
+    results = {}
+    for path, lines in pool.imap_unordered(batchfit, tasks, chunksize=1):
+        results[path] = lines
+        print("   done: {}".format(os.path.basename(path)))
+    pool.close()
+    pool.join()
+
+    summary = open(os.path.join(directory, "eos_summary.out"), "w")
+    summary.write("# material type eos Eo Vo Ko Kpo  (Eo only for E data, Ko in GPa)\n")
+    for path, _, _ in tasks:
+        material = path.rsplit("_")[-1]
+        typePorE = os.path.basename(path)[6]
+        for line in results[path]:
+            summary.write("{:<15} {} {}\n".format(material, typePorE, line))
+    summary.close()
+    print ("\n   Fitting Finished...... \n")
+    print (40 * '-')
+
+def batchfit(task):
+    # one eos.in{E,P}_* file, run in a worker process
+    path, Vo, directory = task
+    material = path.rsplit("_")[-1]
+    typePorE = os.path.basename(path)[6]
+    try:
+        Eoi, Voi, vol, yval, lenvol = getdata(path, typePorE)
+        params = fitall(typePorE, Vo, vol, yval, Eoi, Voi, source=path)
+        list(output_results(material, lenvol, vol, yval, Vo, *params, typePorE, outdir=directory))
+        lines = format_screen_results(*params, typePorE)
+    except Exception as error:
+        lines = ["failed  {}".format(error)]
+    return path, lines
+
 ######################################################
 
 def initial_configuration():
@@ -269,7 +347,7 @@ def process2():
     min = float(input("5.a. Please enter a minimum {} value. (Input value)\n   Value: ".format(choice)))
     max = float(input("5.b. Please enter a maximum {} value. (Input value)\n   Value: ".format(choice)))
     step = float(input("5.c. Please enter a valid step size. (Input value)\n   Value: "))
-    xrange = numpy.linspace(min,max,num = (max - min)/step + 1)
+    xrange = numpy.linspace(min,max,num = int(round((max - min)/step)) + 1)
     print ("")
     print (40 * '-')
     print ("")
@@ -298,17 +376,13 @@ def process2():
                 del params[-3]
                 del params2[-2]
             del params[0]
-            xrange = numpy.linspace(0,100,101)
             Pval = xrange/eVA3toGPa
 
-            out = open("VPEH"+eoschoice+".out_{}".format(material),"w")
-            for i, value in enumerate(Pval):
-                voli = presparams[1]*(1+presparams[3]/presparams[2]*value)**(-1/presparams[3])
-                def f(V):
-                    return geteos(eoschoice,0)[1](V,*params) - value
-                vol = optimization.newton(f, voli, tol=1.0*10**-9)
-                Eval = geteos(eoschoice,0)[0](vol, *params2)
-                out.write("{:15.10f} {:15.10f} {:15.10f} {:15.10f}\n".format(vol,value*eVA3toGPa,Eval,Eval+value*vol))
+            voli = presparams[1]*(1+presparams[3]/presparams[2]*Pval)**(-1/presparams[3])
+            vol = invertpressure(eoschoice, params, Pval, voli)
+            Eval = geteos(eoschoice,0)[0](vol, *params2)
+            numpy.savetxt("VPEH"+eoschoice+".out_{}".format(material),
+                          numpy.column_stack((vol, Pval*eVA3toGPa, Eval, Eval+Pval*vol)), fmt="%15.10f")
 
         else:
             vol = xrange
@@ -344,6 +418,63 @@ def process2():
     sys.exit()
     return True
 
+def invertpressure(eoschoice, params, Pval, Vguess, tol=1.0*10**-9, maxiter=50, stride=64):
+    # Solve P(V) = Pval for every pressure at once. All the P(V) forms depend
+    # on V only through Vo/V, so dP/dV = -(Vo/V) * dP/dVo from geteosjac.
+    P = geteos(eoschoice, 0)[1]
+    dPdVo = geteosjac(eoschoice, 0)[1]
+    Vo = params[0]
+    Pval = numpy.asarray(Pval, dtype=float)
+    Vguess = numpy.broadcast_to(numpy.asarray(Vguess, dtype=float), Pval.shape)
+
+    def newton(V, target):
+        V = numpy.array(V, dtype=float)
+        done = numpy.zeros(V.shape, dtype=bool)
+        for iteration in range(maxiter):
+            with numpy.errstate(all="ignore"):
+                step = (P(V, *params) - target) / (-(Vo / V) * dPdVo(V, *params)[..., 0])
+            Vnew = V - step
+            Vnew = numpy.where(numpy.isfinite(Vnew) & (Vnew > 0), Vnew, 0.5 * V)
+            done = numpy.abs(Vnew - V) <= tol * numpy.abs(Vnew)
+            V = Vnew
+            if done.all():
+                break
+        return V, done
+
+    # continuation: solve every stride-th point first, then start each
+    # point from the solution of its coarse neighbours
+    order = numpy.argsort(Pval)
+    coarse = order[::stride]
+    if len(coarse) > 1 and len(coarse) < len(order):
+        Vcoarse, ok = newton(Vguess[coarse], Pval[coarse])
+        if ok.all():
+            Vguess = numpy.interp(Pval, Pval[coarse], Vcoarse)
+    V, done = newton(Vguess, Pval)
+    if not done.all():
+        V[~done] = bisectpressure(P, params, Pval[~done], Vguess[~done], tol)
+    return V
+
+def bisectpressure(P, params, Pval, Vguess, tol=1.0*10**-9, maxiter=200):
+    # P decreases with V: widen [lo, hi] around the guess, then bisect
+    lo = numpy.array(Vguess, dtype=float)
+    hi = numpy.array(Vguess, dtype=float)
+    with numpy.errstate(all="ignore"):
+        for iteration in range(60):
+            low = ~(P(lo, *params) >= Pval)
+            high = ~(P(hi, *params) <= Pval)
+            if not (low.any() or high.any()):
+                break
+            lo[low] *= 0.5
+            hi[high] *= 2
+        for iteration in range(maxiter):
+            mid = 0.5 * (lo + hi)
+            above = P(mid, *params) > Pval
+            lo = numpy.where(above, mid, lo)
+            hi = numpy.where(above, hi, mid)
+            if numpy.all(hi - lo <= tol * hi):
+                break
+    return 0.5 * (lo + hi)
+
 def getdata(path, typePorE):
     values = numpy.genfromtxt(path)
     vol = values[:, 0]
@@ -449,7 +580,186 @@ def geteos(eoschoice, Vo):
                 return Ko * Kpo / Kpi ** 2 * ((Vo / V) ** Kpi - 1) - Ko * (Kpo - Kpi) / Kpi * numpy.log(Vo / V)
         return E, P
 
-def getparams(eoschoice, typePorE, Vo, vol, yval, *ip):
+def geteosjac(eoschoice, Vo):
+    # analytic parameter Jacobians matching geteos(eoschoice, Vo),
+    # one column per fitting parameter in the same order
+    dE, dP = eosjacobians[eoschoice]
+    if Vo <= 0:
+        return dE, dP
+    def dEfixed(V, Eo, *params):
+        return numpy.delete(dE(V, Eo, Vo, *params), 1, axis=-1)
+    def dPfixed(V, *params):
+        return numpy.delete(dP(V, Vo, *params), 0, axis=-1)
+    return dEfixed, dPfixed
+
+def jaccolumns(V, *columns):
+    V = numpy.asarray(V, dtype=float)
+    return numpy.stack([numpy.broadcast_to(i, V.shape) for i in columns], axis=-1)
+
+def dE2nd(V, Eo, Vo, Ko):
+    r = (Vo / V) ** (2 / 3)
+    u = r - 1
+    return jaccolumns(V, 1, 9 / 8 * Ko * (u ** 2 + 4 / 3 * u * r), 9 / 8 * Vo * u ** 2)
+
+def dP2nd(V, Vo, Ko):
+    r = Vo / V
+    return jaccolumns(V, 1.5 * Ko * (7 / 3 * r ** (7 / 3) - 5 / 3 * r ** (5 / 3)) / Vo,
+                      1.5 * (r ** (7 / 3) - r ** (5 / 3)))
+
+def dE3rd(V, Eo, Vo, Ko, Kpo):
+    u = (Vo / V) ** (2 / 3) - 1
+    B = (Kpo - 4) * u ** 3 + 2 * u ** 2
+    dBdu = 3 * (Kpo - 4) * u ** 2 + 4 * u
+    return jaccolumns(V, 1, 9 / 16 * Ko * (B + 2 / 3 * (u + 1) * dBdu),
+                      9 / 16 * Vo * B, 9 / 16 * Vo * Ko * u ** 3)
+
+def dP3rd(V, Vo, Ko, Kpo):
+    r = Vo / V
+    u = r ** (2 / 3) - 1
+    A = r ** (7 / 3) - r ** (5 / 3)
+    C = 1 + 0.75 * (Kpo - 4) * u
+    dAdVo = (7 / 3 * r ** (7 / 3) - 5 / 3 * r ** (5 / 3)) / Vo
+    dudVo = 2 / 3 * r ** (2 / 3) / Vo
+    return jaccolumns(V, 1.5 * Ko * (dAdVo * C + A * 0.75 * (Kpo - 4) * dudVo),
+                      1.5 * A * C, 1.5 * Ko * A * 0.75 * u)
+
+def dEvin(V, Eo, Vo, Ko, Kpo):
+    a = Kpo - 1
+    s = (V / Vo) ** (1 / 3)
+    eta = s - 1
+    G = 2 + 3 * a * eta
+    X = numpy.exp(-1.5 * a * eta)
+    return jaccolumns(V, 1, 2 * Ko / a ** 2 * ((2 - G * X) + X * a * s * (1 - 0.5 * G)),
+                      2 * Vo / a ** 2 * (2 - G * X),
+                      -4 * Ko * Vo / a ** 3 * (2 - G * X) - 2 * Ko * Vo / a ** 2 * X * (3 * eta - 1.5 * eta * G))
+
+def dPvin(V, Vo, Ko, Kpo):
+    a = Kpo - 1
+    s = (V / Vo) ** (1 / 3)
+    X = numpy.exp(1.5 * a * (1 - s))
+    dPds = 3 * Ko * X * (-1 / s ** 2 - 2 * (1 - s) / s ** 3 - 1.5 * a * (1 - s) / s ** 2)
+    return jaccolumns(V, dPds * (-s / (3 * Vo)), 3 * (1 - s) / s ** 2 * X,
+                      3 * Ko * (1 - s) / s ** 2 * X * 1.5 * (1 - s))
+
+def dEalp(V, Eo, Vo, Ko, alpha):
+    b = alpha - 1
+    r = Vo / V
+    w = r ** (b / 2)
+    return jaccolumns(V, 1, 2 * Ko / b ** 2 * (w - 1) ** 2 + 2 * Ko / b * (w - 1) * w,
+                      2 * Vo / b ** 2 * (w - 1) ** 2,
+                      -4 * Ko * Vo / b ** 3 * (w - 1) ** 2 + 2 * Ko * Vo / b ** 2 * (w - 1) * w * numpy.log(r))
+
+def dPalp(V, Vo, Ko, alpha):
+    b = alpha - 1
+    r = Vo / V
+    A = r ** alpha - r ** ((alpha + 1) / 2)
+    return jaccolumns(V, 2 * Ko / b * (alpha * r ** alpha - (alpha + 1) / 2 * r ** ((alpha + 1) / 2)) / Vo,
+                      2 / b * A,
+                      -2 * Ko / b ** 2 * A + 2 * Ko / b * (r ** alpha - 0.5 * r ** ((alpha + 1) / 2)) * numpy.log(r))
+
+def dEabe(V, Eo, Vo, Ko, alpha, beta):
+    D = alpha - beta
+    r = Vo / V
+    def f(g):
+        return (r ** (g - 1) - 1) / (g - 1)
+    def dfdg(g):
+        return r ** (g - 1) * numpy.log(r) / (g - 1) - (r ** (g - 1) - 1) / (g - 1) ** 2
+    F = f(alpha) - f(beta)
+    return jaccolumns(V, 1, Ko / D * (F + r ** (alpha - 1) - r ** (beta - 1)), Vo / D * F,
+                      -Ko * Vo / D ** 2 * F + Ko * Vo / D * dfdg(alpha),
+                      Ko * Vo / D ** 2 * F - Ko * Vo / D * dfdg(beta))
+
+def dPabe(V, Vo, Ko, alpha, beta):
+    D = alpha - beta
+    r = Vo / V
+    A = r ** alpha - r ** beta
+    return jaccolumns(V, Ko / D * (alpha * r ** alpha - beta * r ** beta) / Vo, A / D,
+                      -Ko / D ** 2 * A + Ko / D * r ** alpha * numpy.log(r),
+                      Ko / D ** 2 * A - Ko / D * r ** beta * numpy.log(r))
+
+def dEmeo(V, Eo, Vo, Ko, Kpo):
+    q = V / Vo
+    K = Kpo
+    H = q ** (1 - K) / (K * (K - 1)) + q / K - 1 / (K - 1)
+    dHdK = (-q ** (1 - K) * numpy.log(q) / (K * (K - 1)) - q ** (1 - K) * (2 * K - 1) / (K * (K - 1)) ** 2
+            - q / K ** 2 + 1 / (K - 1) ** 2)
+    return jaccolumns(V, 1, Ko * (H - (q - q ** (1 - K)) / K), Vo * H, Ko * Vo * dHdK)
+
+def dPmeo(V, Vo, Ko, Kpo):
+    r = Vo / V
+    return jaccolumns(V, Ko * r ** Kpo / Vo, (r ** Kpo - 1) / Kpo,
+                      -Ko / Kpo ** 2 * (r ** Kpo - 1) + Ko / Kpo * r ** Kpo * numpy.log(r))
+
+def dEkea(V, Eo, Vo, Ko, Kpo, Kpi):
+    q = V / Vo
+    r = Vo / V
+    L = (Kpi - 1) * (q - 1) + r ** (Kpi - 1) - 1
+    M = q * numpy.log(r) + q - 1
+    c = 1 / (Kpi ** 2 * (Kpi - 1))
+    dcdKpi = -(3 * Kpi ** 2 - 2 * Kpi) * c ** 2
+    dLdKpi = (q - 1) + r ** (Kpi - 1) * numpy.log(r)
+    return jaccolumns(V, 1,
+                      Ko * Kpo * c * (L + (Kpi - 1) * (r ** (Kpi - 1) - q)) + Ko * (Kpo - Kpi) / Kpi * (M - q * numpy.log(r)),
+                      Kpo * Vo * c * L + Vo * (Kpo - Kpi) / Kpi * M,
+                      Ko * Vo * c * L + Ko * Vo / Kpi * M,
+                      Ko * Kpo * Vo * (dcdKpi * L + c * dLdKpi) - Ko * Vo * Kpo / Kpi ** 2 * M)
+
+def dPkea(V, Vo, Ko, Kpo, Kpi):
+    r = Vo / V
+    return jaccolumns(V, Ko / Vo * (Kpo / Kpi * r ** Kpi - (Kpo - Kpi) / Kpi),
+                      Kpo / Kpi ** 2 * (r ** Kpi - 1) - (Kpo - Kpi) / Kpi * numpy.log(r),
+                      Ko / Kpi ** 2 * (r ** Kpi - 1) - Ko / Kpi * numpy.log(r),
+                      -2 * Ko * Kpo / Kpi ** 3 * (r ** Kpi - 1) + Ko * Kpo / Kpi ** 2 * r ** Kpi * numpy.log(r)
+                      + Ko * Kpo / Kpi ** 2 * numpy.log(r))
+
+eosjacobians = {"2nd": (dE2nd, dP2nd), "3rd": (dE3rd, dP3rd), "vin": (dEvin, dPvin),
+                "alp": (dEalp, dPalp), "abe": (dEabe, dPabe), "meo": (dEmeo, dPmeo),
+                "kea": (dEkea, dPkea)}
+
+# function evaluations used by the last fit of each eos, see jacbenchmark()
+fitcounts = {}
+
+# fitted parameters are kept on disk (see eigen_cache) under a hash of the
+# data, the eos, E or P and the fixed Vo, so an unchanged eos.in_* file is
+# not refitted; the last optimum for each file is the starting guess when
+# its data change (e.g. one more DFT point)
+# Environment: EOS_CACHE_DIR (default .eos_cache next to the eos.in_* file,
+#                             so runs from any directory share it)
+#              EOS_CACHE_MB  (default 16, 0 disables)
+FIT_CACHE_DIR = os.environ.get("EOS_CACHE_DIR")
+FIT_CACHE_MB = float(os.environ.get("EOS_CACHE_MB", 16))
+
+def fitkeys(eoschoice, typePorE, Vo, vol, yval, usejac, source):
+    settings = dict(eos=eoschoice, type=typePorE, Vo=float(Vo), usejac=usejac)
+    key = eigen_cache.array_key(numpy.column_stack((vol, yval)).astype(float), **settings)
+    warmkey = None
+    if source is not None:
+        warmkey = eigen_cache.array_key(numpy.zeros(0), source=os.path.abspath(source), **settings)
+    return key, warmkey
+
+def fitcachedir(source):
+    if FIT_CACHE_DIR is not None:
+        return FIT_CACHE_DIR
+    if source is None:
+        return ".eos_cache"
+    return os.path.join(os.path.dirname(os.path.abspath(source)), ".eos_cache")
+
+def loadfit(key, source=None):
+    if key is None or FIT_CACHE_MB <= 0:
+        return None
+    return eigen_cache.load(key, fitcachedir(source))
+
+def storefit(keys, par, source=None):
+    # batch workers share the directory, so a lost race only costs a refit
+    for key in keys:
+        if key is not None and FIT_CACHE_MB > 0:
+            try:
+                eigen_cache.store(key, numpy.asarray(par, dtype=float), fitcachedir(source),
+                                  int(FIT_CACHE_MB * 2**20))
+            except OSError:
+                pass
+
+def getparams(eoschoice, typePorE, Vo, vol, yval, *ip, usejac=True, source=None, cache=True):
     if Vo > 0:
         ip = list(ip)
         del ip[1]
@@ -459,8 +769,30 @@ def getparams(eoschoice, typePorE, Vo, vol, yval, *ip):
         val = 1
         ip = list(ip)
         del ip[0]
+    jac = geteosjac(eoschoice, Vo)[val] if usejac else None
+    keys = fitkeys(eoschoice, typePorE, Vo, vol, yval, usejac, source) if cache else (None, None)
+    par = loadfit(keys[0], source)
+    previous = loadfit(keys[1], source)
+    starts = [ip]
+    if previous is not None and len(previous) == len(ip):
+        starts.insert(0, previous)
     try:
-        par, var = optimization.curve_fit(geteos(eoschoice, Vo)[val], vol, yval, p0=ip, maxfev=20000)
+        if par is not None and len(par) == len(ip):
+            fitcounts[eoschoice] = (0, 0)
+        else:
+            for attempt, p0 in enumerate(starts):
+                # a warm start from a stale optimum can fail where the crude
+                # guesses do not, so fall back to them before giving up
+                try:
+                    par, var, info, mesg, ier = optimization.curve_fit(geteos(eoschoice, Vo)[val], vol, yval,
+                                                                       p0=p0, jac=jac, maxfev=20000,
+                                                                       full_output=True)
+                    break
+                except RuntimeError:
+                    if attempt == len(starts) - 1:
+                        raise
+            fitcounts[eoschoice] = (info["nfev"], info.get("njev", 0))
+            storefit(keys, par, source)
     except RuntimeError:
         print("Warning: The call to the function for {} failed to converge.".format(eoschoice))
         par = [0] * len(ip)
@@ -478,32 +810,38 @@ def getparams(eoschoice, typePorE, Vo, vol, yval, *ip):
         return par
 
 def output_screen_results(param1, param2, param3, param4, param5, param6, param7, typePorE):
+    for line in format_screen_results(param1, param2, param3, param4, param5, param6, param7, typePorE):
+        print(line)
+    print ("\n   Fitting Finished...... \n")
+    print (40 * '-')
+
+def format_screen_results(param1, param2, param3, param4, param5, param6, param7, typePorE):
     eVA3toGPa = 160.2176487
+    lines = []
     if typePorE == "P":
         eVA3toGPa = 1 # no need to convert, already in GPa
-        print("2bmeos {:15.10f} {:15.10f}    4.0".format(param1[0], param1[1] * eVA3toGPa))
-        print("3bmeos {:15.10f} {:15.10f} {:15.10f}".format(param2[0], param2[1] * eVA3toGPa, param2[2]))
-        print("vinet  {:15.10f} {:15.10f} {:15.10f}".format(param3[0], param3[1] * eVA3toGPa, param3[2]))
-        print("alpha  {:15.10f} {:15.10f} {:15.10f}".format(param4[0], param4[1] * eVA3toGPa, (3 * param4[2] + 1) / 2))
-        print("abeos  {:15.10f} {:15.10f} {:15.10f}".format(param5[0], param5[1] * eVA3toGPa, param5[2] + param5[3]))
-        print("m_eos  {:15.10f} {:15.10f} {:15.10f}".format(param6[0], param6[1] * eVA3toGPa, param6[2]))
-        print("keane  {:15.10f} {:15.10f} {:15.10f}".format(param7[0], param7[1] * eVA3toGPa, param7[2]))
+        lines.append("2bmeos {:15.10f} {:15.10f}    4.0".format(param1[0], param1[1] * eVA3toGPa))
+        lines.append("3bmeos {:15.10f} {:15.10f} {:15.10f}".format(param2[0], param2[1] * eVA3toGPa, param2[2]))
+        lines.append("vinet  {:15.10f} {:15.10f} {:15.10f}".format(param3[0], param3[1] * eVA3toGPa, param3[2]))
+        lines.append("alpha  {:15.10f} {:15.10f} {:15.10f}".format(param4[0], param4[1] * eVA3toGPa, (3 * param4[2] + 1) / 2))
+        lines.append("abeos  {:15.10f} {:15.10f} {:15.10f}".format(param5[0], param5[1] * eVA3toGPa, param5[2] + param5[3]))
+        lines.append("m_eos  {:15.10f} {:15.10f} {:15.10f}".format(param6[0], param6[1] * eVA3toGPa, param6[2]))
+        lines.append("keane  {:15.10f} {:15.10f} {:15.10f}".format(param7[0], param7[1] * eVA3toGPa, param7[2]))
     else:
-        print("2bmeos {:15.10f} {:15.10f} {:15.10f}    4.0".format(param1[0], param1[1], param1[2] * eVA3toGPa))
-        print("3bmeos {:15.10f} {:15.10f} {:15.10f} {:15.10f}".format(param2[0], param2[1], param2[2] * eVA3toGPa, param2[3]))
-        print("vinet  {:15.10f} {:15.10f} {:15.10f} {:15.10f}".format(param3[0], param3[1], param3[2] * eVA3toGPa, param3[3]))
-        print("alpha  {:15.10f} {:15.10f} {:15.10f} {:15.10f}".format(param4[0], param4[1], param4[2] * eVA3toGPa, (3 * param4[3] + 1) / 2))
-        print("abeos  {:15.10f} {:15.10f} {:15.10f} {:15.10f}".format(param5[0], param5[1], param5[2] * eVA3toGPa, param5[3] + param5[4]))
-        print("m_eos  {:15.10f} {:15.10f} {:15.10f} {:15.10f}".format(param6[0], param6[1], param6[2] * eVA3toGPa, param6[3]))
-        print("keane  {:15.10f} {:15.10f} {:15.10f} {:15.10f}".format(param7[0], param7[1], param7[2] * eVA3toGPa, param7[3]))
-    print ("\n   Fitting Finished...... \n")
-    print (40 * '-')
+        lines.append("2bmeos {:15.10f} {:15.10f} {:15.10f}    4.0".format(param1[0], param1[1], param1[2] * eVA3toGPa))
+        lines.append("3bmeos {:15.10f} {:15.10f} {:15.10f} {:15.10f}".format(param2[0], param2[1], param2[2] * eVA3toGPa, param2[3]))
+        lines.append("vinet  {:15.10f} {:15.10f} {:15.10f} {:15.10f}".format(param3[0], param3[1], param3[2] * eVA3toGPa, param3[3]))
+        lines.append("alpha  {:15.10f} {:15.10f} {:15.10f} {:15.10f}".format(param4[0], param4[1], param4[2] * eVA3toGPa, (3 * param4[3] + 1) / 2))
+        lines.append("abeos  {:15.10f} {:15.10f} {:15.10f} {:15.10f}".format(param5[0], param5[1], param5[2] * eVA3toGPa, param5[3] + param5[4]))
+        lines.append("m_eos  {:15.10f} {:15.10f} {:15.10f} {:15.10f}".format(param6[0], param6[1], param6[2] * eVA3toGPa, param6[3]))
+        lines.append("keane  {:15.10f} {:15.10f} {:15.10f} {:15.10f}".format(param7[0], param7[1], param7[2] * eVA3toGPa, param7[3]))
+    return lines
 
-def output_results(material, lenvol, vol, yval, Vo, param1, param2, param3, param4, param5, param6, param7, typePorE):
+def output_results(material, lenvol, vol, yval, Vo, param1, param2, param3, param4, param5, param6, param7, typePorE, outdir="."):
     eVA3toGPa = 160.2176487
     if typePorE == "E":
         # E2ndeos.out_
-        output = open("E2ndeos.out_{}".format(material), "w")
+        output = open(os.path.join(outdir, "E2ndeos.out_{}".format(material)), "w")
         output.write("{:15.10f} {:15.10f} {:15.10f}    4.0\n".format(param1[0], param1[1], param1[2] * eVA3toGPa))
         output.write("\n Eo + ((9 * Vo * Ko) / 8) * ((Vo / V) ** (2 / 3) - 1) ** 2 \n")
         output.write("\n " + str(lenvol) + "\n")
@@ -515,7 +853,7 @@ def output_results(material, lenvol, vol, yval, Vo, param1, param2, param3, para
         output.close()
         yield Efit[:]
         # E3rdeos.out_
-        output = open("E3rdeos.out_{}".format(material), "w")
+        output = open(os.path.join(outdir, "E3rdeos.out_{}".format(material)), "w")
         output.write("{:15.10f} {:15.10f} {:15.10f} {:15.10f}\n".format(param2[0], param2[1], param2[2] * eVA3toGPa, param2[3]))
         output.write("\n Eo + ((9 * Vo * Ko) / 16) * ((Vo ** (2 / 3) * V ** "
                      "(-1 * 2 / 3) - 1) ** 3 * Kpo + ((Vo ** (2 / 3) * V ** "
@@ -529,7 +867,7 @@ def output_results(material, lenvol, vol, yval, Vo, param1, param2, param3, para
         output.close()
         yield Efit[:]
         # Evineos.out_
-        output = open("Evineos.out_{}".format(material), "w")
+        output = open(os.path.join(outdir, "Evineos.out_{}".format(material)), "w")
         output.write("{:15.10f} {:15.10f} {:15.10f} {:15.10f}\n".format(param3[0], param3[1], param3[2] * eVA3toGPa, param3[3]))
         output.write("\n Eo + 4 * Ko * Vo / (Kpo - 1) ** 2 - 2 * Vo * "
                      "Ko / (Kpo - 1) ** 2 * (5 + 3 * Kpo * ((V / Vo) ** "
@@ -544,7 +882,7 @@ def output_results(material, lenvol, vol, yval, Vo, param1, param2, param3, para
         output.close()
         yield Efit[:]
         # Ealpeos.out_
-        output = open("Ealpeos.out_{}".format(material), "w")
+        output = open(os.path.join(outdir, "Ealpeos.out_{}".format(material)), "w")
         output.write("{:15.10f} {:15.10f} {:15.10f} {:15.10f} {:15.10f} : alpha\n".format(param4[0], param4[1], param4[2] * eVA3toGPa, (3 * param4[3] + 1) / 2, param4[3]))
         output.write("\n Eo + 2 * Ko * Vo / (alpha - 1) ** 2 * "
                      "((Vo / V) ** ((alpha - 1) / 2) - 1) ** 2 \n")
@@ -556,7 +894,7 @@ def output_results(material, lenvol, vol, yval, Vo, param1, param2, param3, para
         output.close()
         yield Efit[:]
         # Eabeeos.out_
-        output = open("Eabeeos.out_{}".format(material), "w")
+        output = open(os.path.join(outdir, "Eabeeos.out_{}".format(material)), "w")
         output.write("{:15.10f} {:15.10f} {:15.10f} {:15.10f} {:15.10f} {:15.10f} : alpha, beta\n".format(param5[0], param5[1], param5[2] * eVA3toGPa, param5[3] + param5[4], param5[3], param5[4]))
         output.write("\n Eo + Ko * Vo / (alpha - beta) * (1 / (alpha - 1) "
                      "* ((Vo / V) ** (alpha - 1) - 1) - 1 / (beta - 1) * "
@@ -569,7 +907,7 @@ def output_results(material, lenvol, vol, yval, Vo, param1, param2, param3, para
         output.close()
         yield Efit[:]
         # Emeoeos.out_
-        output = open("Emeoeos.out_{}".format(material), "w")
+        output = open(os.path.join(outdir, "Emeoeos.out_{}".format(material)), "w")
         output.write("{:15.10f} {:15.10f} {:15.10f} {:15.10f}\n".format(param6[0], param6[1], param6[2] * eVA3toGPa, param6[3]))
         output.write("\n Eo + Ko * Vo * ((1 / (Kpo * (Kpo - 1)) * (V / Vo)"
                      " ** (1 - Kpo) + 1 / Kpo * V / Vo - 1 / (Kpo - 1))) \n")
@@ -581,7 +919,7 @@ def output_results(material, lenvol, vol, yval, Vo, param1, param2, param3, para
         output.close()
         yield Efit[:]
         # Ekeaeos.out_
-        output = open("Ekeaeos.out_{}".format(material), "w")
+        output = open(os.path.join(outdir, "Ekeaeos.out_{}".format(material)), "w")
         output.write("{:15.10f} {:15.10f} {:15.10f} {:15.10f} {:15.10f} : Kpi\n".format(param7[0], param7[1], param7[2] * eVA3toGPa, param7[3], param7[4]))
         output.write("\n Eo + Ko * Kpo * Vo / Kpi ** 2 / (Kpi - 1) * "
                      "((Kpi - 1) * (V / Vo - 1) + (Vo / V) ** (Kpi - 1) - 1) + "
@@ -596,7 +934,7 @@ def output_results(material, lenvol, vol, yval, Vo, param1, param2, param3, para
         yield Efit[:]
     else:
         # P2ndeos.out_
-        output = open("P2ndeos.out_{}".format(material), "w")
+        output = open(os.path.join(outdir, "P2ndeos.out_{}".format(material)), "w")
         output.write("{:15.10f} {:15.10f}    4.0\n".format(param1[0], param1[1]))
         output.write("\n 1.5 * Ko * ((Vo / V) ** (7 / 3) - (Vo / V) ** (5 / 3)) \n")
         output.write("\n " + str(lenvol) + "\n")
@@ -608,7 +946,7 @@ def output_results(material, lenvol, vol, yval, Vo, param1, param2, param3, para
         output.close()
         yield Pfit[:]
         # E3rdeos.out_
-        output = open("P3rdeos.out_{}".format(material), "w")
+        output = open(os.path.join(outdir, "P3rdeos.out_{}".format(material)), "w")
         output.write(
             "{:15.10f} {:15.10f} {:15.10f}\n".format(param2[0], param2[1], param2[2]))
         output.write("\n 1.5 * Ko * ((Vo / V) ** (7 / 3) - (Vo / V) ** (5 / 3)) * ("\
@@ -621,7 +959,7 @@ def output_results(material, lenvol, vol, yval, Vo, param1, param2, param3, para
         output.close()
         yield Pfit[:]
         # Evineos.out_
-        output = open("Pvineos.out_{}".format(material), "w")
+        output = open(os.path.join(outdir, "Pvineos.out_{}".format(material)), "w")
         output.write(
             "{:15.10f} {:15.10f} {:15.10f}\n".format(param3[0], param3[1], param3[2]))
         output.write("\n 3 * Ko * (1 - (V / Vo) ** (1 / 3)) / ((V / Vo) ** (2 / 3)) * numpy.exp("\
@@ -634,7 +972,7 @@ def output_results(material, lenvol, vol, yval, Vo, param1, param2, param3, para
         output.close()
         yield Pfit[:]
         # Ealpeos.out_
-        output = open("Palpeos.out_{}".format(material), "w")
+        output = open(os.path.join(outdir, "Palpeos.out_{}".format(material)), "w")
         output.write("{:15.10f} {:15.10f} {:15.10f} {:15.10f} : alpha\n".format(param4[0], param4[1],
                                                                         (3 * param4[2] + 1) / 2, param4[2]))
         output.write("\n 2 * Ko / (alpha - 1) * ((Vo / V) ** alpha - (Vo / V) ** ((alpha + 1) / 2)) \n")
@@ -646,7 +984,7 @@ def output_results(material, lenvol, vol, yval, Vo, param1, param2, param3, para
         output.close()
         yield Pfit[:]
         # Eabeeos.out_
-        output = open("Pabeeos.out_{}".format(material), "w")
+        output = open(os.path.join(outdir, "Pabeeos.out_{}".format(material)), "w")
         output.write("{:15.10f} {:15.10f} {:15.10f} {:15.10f} {:15.10f} : alpha, beta\n".format(param5[0], param5[1], param5[2] + param5[3], param5[2], param5[3]))
         output.write("\n Ko / (alpha - beta) * ((Vo / V) ** alpha - (Vo / V) ** beta) \n")
         output.write("\n " + str(lenvol) + "\n")
@@ -657,7 +995,7 @@ def output_results(material, lenvol, vol, yval, Vo, param1, param2, param3, para
         output.close()
         yield Pfit[:]
         # Emeoeos.out_
-        output = open("Pmeoeos.out_{}".format(material), "w")
+        output = open(os.path.join(outdir, "Pmeoeos.out_{}".format(material)), "w")
         output.write(
             "{:15.10f} {:15.10f} {:15.10f}\n".format(param6[0], param6[1], param6[2]))
         output.write("\n Ko / Kpo * ((Vo / V) ** Kpo - 1) \n")
@@ -669,7 +1007,7 @@ def output_results(material, lenvol, vol, yval, Vo, param1, param2, param3, para
         output.close()
         yield Pfit[:]
         # Ekeaeos.out_
-        output = open("Pkeaeos.out_{}".format(material), "w")
+        output = open(os.path.join(outdir, "Pkeaeos.out_{}".format(material)), "w")
         output.write(
             "{:15.10f} {:15.10f} {:15.10f} {:15.10f} : Kpi\n".format(param7[0], param7[1], param7[2], param7[3]))
         output.write("\n Ko * Kpo / Kpi ** 2 * ((Vo / V) ** Kpi - 1) - Ko * "
@@ -0,0 +1,190 @@
+###############################################
+#
+#    script: kpm_dos.py
+#
+#    Author: Paul Sanders (phs0007@auburn.edu)
+#
+#    Purpose: Density of States of a large dynamical
+#             matrix from Chebyshev moments (kernel
+#             polynomial method), using only products
+#             of the matrix with vectors
+#
+#    The matrix is scaled into [-1, 1] with Gershgorin
+#    (or Lanczos) bounds, mu_m = Tr T_m(H)/n is estimated
+#    with random +-1 probe vectors, and the series is
+#    damped with the Jackson kernel. num_moments sets the
+#    resolution (about pi * bandwidth / num_moments, or
+#    give resolution directly), num_probes the statistical
+#    error (about 1/sqrt(n * num_probes)). Probes are
+#    applied batch at a time as one (n, batch) block.
+#
+#    The resolution is uniform in eigenvalue (omega**2),
+#    so in frequency it is resolution / (2 omega):
+#    frequency_resolution() converts a frequency smearing
+#    at a reference omega. frequency_density integrates
+#    to 1 per mode (rho() in eigenvalue_vasp integrates
+#    to dos_broadening.GAUSSIAN_WEIGHT).
+#
+#    array may be a dense or sparse matrix, or any
+#    scipy.sparse.linalg.LinearOperator such as
+#    circulant_operator(row) for a periodic chain, so
+#    time and memory are linear in n for a given
+#    resolution.
+#
+###############################################
+
+import numpy
+import numpy.polynomial.chebyshev
+import scipy.sparse
+import scipy.sparse.linalg
+import sparse_solver
+
+def as_operator(array):
+    # circulant sparse matrices with long-range rows become FFT operators,
+    # which is cheaper once a row has more than ~2 log2(n) entries; short
+    # rows (nearest-neighbour chains) are faster as sparse products
+    if scipy.sparse.issparse(array):
+        row = sparse_solver.circulant_row(array)
+        if row is not None and numpy.count_nonzero(row) > 2 * numpy.log2(len(row)) \
+                and numpy.allclose(row, numpy.roll(row[::-1], 1)):
+            return circulant_operator(row)
+    return array
+
+def circulant_operator(row):
+    # symmetric circulant matrix A_ij = row[(j - i) % n] as a
+    # LinearOperator, applied with FFTs; its bounds are exact
+    row = numpy.asarray(row, dtype=float)
+    if not numpy.allclose(row, numpy.roll(row[::-1], 1)):
+        raise ValueError("Circulant row is not symmetric")
+    spectrum = numpy.fft.rfft(row)
+    n = len(row)
+
+    def matmat(v):
+        # transforms run along contiguous rows of v.T
+        v = numpy.asarray(v, dtype=float).reshape(n, -1).T
+        return numpy.fft.irfft(numpy.fft.rfft(v) * spectrum.real, n).T
+
+    operator = scipy.sparse.linalg.LinearOperator(
+        (n, n), matvec=lambda v: matmat(v).ravel(), matmat=matmat, dtype=float)
+    eigens = spectrum.real
+    operator.bounds = (numpy.amin(eigens), numpy.amax(eigens))
+    return operator
+
+def spectral_bounds(array):
+    # Gershgorin discs: every eigenvalue lies in [lo, hi]; for other
+    # operators, extreme Lanczos eigenvalues widened by 1%
+    if hasattr(array, "bounds"):
+        return array.bounds
+    if isinstance(array, scipy.sparse.linalg.LinearOperator):
+        hi = scipy.sparse.linalg.eigsh(array, k=1, which="LA", tol=1e-4,
+                                       return_eigenvectors=False)[0]
+        lo = scipy.sparse.linalg.eigsh(array, k=1, which="SA", tol=1e-4,
+                                       return_eigenvectors=False)[0]
+        margin = 0.01 * (hi - lo)
+        return lo - margin, hi + margin
+    if scipy.sparse.issparse(array):
+        array = scipy.sparse.csr_matrix(array)
+        diagonal = array.diagonal()
+        radius = numpy.asarray(abs(array).sum(axis=1)).ravel() - numpy.abs(diagonal)
+    else:
+        array = numpy.asarray(array)
+        diagonal = numpy.diagonal(array)
+        radius = numpy.abs(array).sum(axis=1) - numpy.abs(diagonal)
+    return numpy.amin(diagonal - radius), numpy.amax(diagonal + radius)
+
+def chebyshev_moments(array, num_moments=256, num_probes=64, batch=16,
+                      bounds=None, seed=0, epsilon=0.01):
+    # returns the moments and the (center, half width) used for scaling
+    n = array.shape[0]
+    lo, hi = spectral_bounds(array) if bounds is None else bounds
+    center = 0.5 * (hi + lo)
+    half = 0.5 * (hi - lo) / (1 - 0.5 * epsilon)
+    if half == 0:
+        half = 1.0
+
+    # scale once so that every step is a single product
+    if scipy.sparse.issparse(array):
+        scaled = (scipy.sparse.csr_matrix(array)
+                  - center * scipy.sparse.identity(n, format="csr")) / half
+        apply = scaled.dot
+    elif isinstance(array, scipy.sparse.linalg.LinearOperator):
+        def apply(v):
+            return (array @ v - center * v) / half
+    else:
+        scaled = numpy.array(array, dtype=float)
+        scaled[numpy.diag_indices(n)] -= center
+        scaled /= half
+        apply = scaled.dot
+
+    # mu_2k = 2<v_k, v_k> - mu_0 and mu_2k+1 = 2<v_k+1, v_k> - mu_1 give
+    # two moments per product
+    rng = numpy.random.default_rng(seed)
+    moments = numpy.zeros(num_moments)
+    for start in range(0, num_probes, batch):
+        probes = rng.choice((-1.0, 1.0), size=(n, min(batch, num_probes - start)))
+        previous, current = probes, apply(probes)
+        mu0 = float(probes.size)
+        mu1 = numpy.vdot(probes, current)
+        moments[0] += mu0
+        if num_moments > 1:
+            moments[1] += mu1
+        for k in range(1, (num_moments + 1) // 2):
+            following = apply(current)
+            following *= 2
+            following -= previous
+            moments[2 * k] += 2 * numpy.vdot(current, current) - mu0
+            if 2 * k + 1 < num_moments:
+                moments[2 * k + 1] += 2 * numpy.vdot(following, current) - mu1
+            previous, current = current, following
+    return moments / (n * num_probes), (center, half)
+
+def jackson_kernel(num_moments):
+    m = numpy.arange(num_moments)
+    a = numpy.pi / (num_moments + 1)
+    return ((num_moments - m + 1) * numpy.cos(a * m)
+            + numpy.sin(a * m) / numpy.tan(a)) / (num_moments + 1)
+
+def eigenvalue_density(moments, scaling, x):
+    # density of eigenvalues at x, normalized to 1
+    center, half = scaling
+    t = (numpy.asarray(x, dtype=float) - center) / half
+    coefficients = moments * jackson_kernel(len(moments))
+    coefficients[1:] *= 2
+    density = numpy.zeros(len(t))
+    inside = numpy.abs(t) < 1
+    density[inside] = (numpy.polynomial.chebyshev.chebval(t[inside], coefficients)
+                       / (numpy.pi * numpy.sqrt(1 - t[inside]**2)))
+    return density / half
+
+def frequency_density(moments, scaling, x):
+    # density of sqrt(eigenvalue) at x >= 0, g(w) = 2 w rho(w**2),
+    # normalized to 1 per mode
+    x = numpy.asarray(x, dtype=float)
+    density = numpy.zeros(len(x))
+    positive = x > 0
+    density[positive] = 2 * x[positive] * eigenvalue_density(moments, scaling, x[positive]**2)
+    return density
+
+def moments_for_resolution(bounds, resolution):
+    # number of moments whose Jackson kernel width is about resolution
+    # (in eigenvalue units)
+    lo, hi = bounds
+    return max(2, int(numpy.ceil(numpy.pi * 0.5 * (hi - lo) / resolution)))
+
+def frequency_resolution(sigma, omega):
+    # eigenvalue resolution giving a frequency width of about sigma at
+    # omega, from d(omega**2) = 2 omega d(omega); it is sigma * omega / w
+    # at other frequencies w
+    return 2 * omega * sigma
+
+def dos(array, x, num_moments=256, num_probes=64, batch=16, seed=0,
+        resolution=None, bounds=None):
+    # frequency DOS on x, the KPM counterpart of rho(x, eigens(array), ...);
+    # resolution (eigenvalue units) overrides num_moments
+    if bounds is None:
+        bounds = spectral_bounds(array)
+    if resolution is not None:
+        num_moments = moments_for_resolution(bounds, resolution)
+    moments, scaling = chebyshev_moments(array, num_moments, num_probes, batch,
+                                         bounds=bounds, seed=seed)
+    return frequency_density(moments, scaling, x)
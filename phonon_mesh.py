@@ -0,0 +1,300 @@
+###############################################
+#
+#    script: phonon_mesh.py
+#
+#    Author: Paul Sanders (phs0007@auburn.edu)
+#
+#    Purpose: Phonon Density of States from a q-point
+#             mesh instead of one Gamma-point supercell
+#
+#    The Monkhorst-Pack mesh is reduced to its
+#    irreducible points (point group of the crystal
+#    plus time reversal) with weights. The points are
+#    diagonalized in chunks across a process pool; the
+#    dynamical matrix data lives in shared memory and
+#    each chunk comes back as a weighted histogram on
+#    the fine grid of dos_broadening, so memory does
+#    not grow with the mesh. The summed histogram is
+#    broadened once at the end. The tetrahedron method
+#    below needs no broadening at all and converges on
+#    much coarser meshes.
+#
+#    The force constants are assumed to have the
+#    symmetry of the crystal found by crystal_rotations.
+#
+###############################################
+
+import itertools
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy
+import dos_broadening
+import phonon_qpoints
+
+###############################################
+
+def lattice_rotations(lattice, tol=1e-5):
+    # integer matrices W acting on row fractional coordinates (x -> x.W)
+    # that keep every length, i.e. W.G.W^T = G with G = L.L^T. Entries are
+    # limited to -1, 0, 1, which covers Niggli-reduced cells.
+    lattice = numpy.asarray(lattice, dtype=float)
+    metric = lattice.dot(lattice.T)
+    candidates = numpy.array(list(itertools.product((-1, 0, 1), repeat=9))).reshape(-1, 3, 3)
+    candidates = candidates[numpy.abs(numpy.rint(numpy.linalg.det(candidates))) == 1]
+    rotated = numpy.einsum("nij,jk,nlk->nil", candidates, metric, candidates)
+    keep = numpy.all(numpy.abs(rotated - metric) <= tol * numpy.abs(metric).max(), axis=(1, 2))
+    return candidates[keep]
+
+def crystal_rotations(primitive, tol=1e-5):
+    # rotations of the lattice that, with some translation, map every atom
+    # onto an atom of the same species
+    species = numpy.repeat(numpy.arange(len(primitive.counts)), primitive.counts)
+    x = primitive.positions
+    rotations = []
+    for W in lattice_rotations(primitive.lattice * primitive.scale, tol):
+        xw = x.dot(W)
+        for j in numpy.nonzero(species == species[0])[0]:
+            d = xw[:, None, :] + (x[j] - xw[0]) - x[None, :, :]
+            d = numpy.abs(d - numpy.rint(d)).max(axis=-1) <= tol
+            if numpy.all(numpy.any(d & (species[:, None] == species[None, :]), axis=1)):
+                rotations.append(W)
+                break
+    return numpy.array(rotations)
+
+def mesh_map(mesh, rotations=None, shift=(0, 0, 0), time_reversal=True):
+    # for every point of phonon_qpoints.mpmesh(mesh, shift), the smallest
+    # index in its orbit; rotations that do not map the mesh onto itself
+    # are dropped
+    mesh = numpy.array(mesh, dtype=int)
+    shift = numpy.asarray(shift, dtype=float)
+    if not numpy.allclose(2 * shift, numpy.rint(2 * shift)):
+        raise ValueError("The mesh shift must be 0 or 1/2 of a grid spacing")
+    offset = 1 - mesh + numpy.rint(2 * shift).astype(int)
+    grid = numpy.indices(mesh).reshape(3, -1).T
+    doubled = 2 * grid + offset  # q = doubled/(2 mesh)
+
+    if rotations is None:
+        rotations = numpy.eye(3, dtype=int)[None]
+    rotations = numpy.asarray(rotations)
+    if time_reversal:
+        rotations = numpy.concatenate((rotations, -rotations))
+
+    representative = numpy.arange(len(grid))
+    for W in rotations:
+        # q -> q.W^T in units of the grid of each axis
+        image = numpy.dot(doubled / mesh, W.T) * mesh
+        if not numpy.allclose(image, numpy.rint(image)):
+            continue
+        image = numpy.rint(image).astype(int) - offset
+        if numpy.any(image % 2):
+            continue
+        index = numpy.ravel_multi_index(((image // 2) % mesh).T, mesh)
+        representative = numpy.minimum(representative, index)
+    return representative
+
+def irreducible_qpoints(mesh, rotations=None, shift=(0, 0, 0), time_reversal=True):
+    # irreducible points of the mesh and their weights (summing to 1)
+    representative = mesh_map(mesh, rotations, shift, time_reversal)
+    points, weights = numpy.unique(representative, return_counts=True)
+    qpoints = phonon_qpoints.mpmesh(mesh, shift)[points]
+    return qpoints, weights / float(len(representative))
+
+###############################################
+
+SHARED = ("pairs", "vectors", "blocks")
+
+_worker = {}
+
+def share_dynamical_matrix(dynmat):
+    # copy the arrays D(q) is built from into shared memory blocks
+    blocks, specs = [], []
+    for attr in SHARED:
+        array = numpy.ascontiguousarray(getattr(dynmat, attr))
+        block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        numpy.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs.append((attr, block.name, array.shape, array.dtype.str))
+    return blocks, (dynmat.natom, specs)
+
+def attach_dynamical_matrix(natom, specs):
+    dynmat = phonon_qpoints.DynamicalMatrix.__new__(phonon_qpoints.DynamicalMatrix)
+    dynmat.natom = natom
+    for attr, name, shape, dtype in specs:
+        block = shared_memory.SharedMemory(name=name)
+        _worker[attr] = block  # keep the mapping alive
+        setattr(dynmat, attr, numpy.ndarray(shape, dtype, buffer=block.buf))
+    _worker["dynmat"] = dynmat
+
+def pool_results(dynmat, function, tasks, processes=None):
+    # function(dynmat, *task) for every task, in order, across a pool
+    # whose workers share the arrays of dynmat
+    blocks, shared = share_dynamical_matrix(dynmat)
+    try:
+        with multiprocessing.Pool(processes, attach_dynamical_matrix, shared) as pool:
+            for result in pool.imap(_run_task, ((function, task) for task in tasks)):
+                yield result
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+def _run_task(job):
+    function, task = job
+    return function(_worker["dynmat"], *task)
+
+def bin_frequencies(dynmat, qpoints, weights, grid, factor=1, chunk=256):
+    # weighted fine-grid histogram of the frequencies at qpoints
+    x0, h, npoints = grid[:3]
+    hist = numpy.zeros(npoints)
+    for start in range(0, len(qpoints), chunk):
+        frequencies = dynmat.frequencies(qpoints[start:start + chunk], factor, chunk)
+        modes = numpy.repeat(weights[start:start + chunk], frequencies.shape[1])
+        hist += dos_broadening.histogram(frequencies.ravel(), x0, h, npoints, modes)
+    return hist
+
+def get_frequencies(dynmat, qpoints, factor=1, chunk=256):
+    return dynmat.frequencies(qpoints, factor, chunk)
+
+def mesh_frequencies(dynmat, qpoints, factor=1, processes=None, chunk=256):
+    tasks = [(qpoints[start:start + chunk], factor, chunk)
+             for start in range(0, len(qpoints), chunk)]
+    if processes == 1 or len(tasks) <= 1:
+        parts = [get_frequencies(dynmat, *task) for task in tasks]
+    else:
+        parts = list(pool_results(dynmat, get_frequencies, tasks, processes))
+    return numpy.concatenate(parts)
+
+def mesh_dos(dynmat, mesh, x, sigma, N=None, rotations=None, shift=(0, 0, 0),
+             factor=1, processes=None, chunk=256, kernel="gaussian",
+             cutoff=None, points_per_sigma=20):
+    # DOS on the uniform grid x, normalized like eigenvalue_vasp.rho with
+    # N = 3 * natom modes per q-point by default; the default cutoff is
+    # dos_broadening.CUTOFFS[kernel] (the whole span of x for a Lorentzian,
+    # modes further off than that are left out)
+    x = numpy.asarray(x, dtype=float)
+    if not dos_broadening.is_uniform(x):
+        raise ValueError("mesh_dos needs a uniform frequency grid")
+    if cutoff is None:
+        cutoff = dos_broadening.CUTOFFS[kernel]
+    if N is None:
+        N = 3 * dynmat.natom
+    qpoints, weights = irreducible_qpoints(mesh, rotations, shift)
+    grid = dos_broadening.fine_grid(x, sigma, cutoff, points_per_sigma)
+    tasks = ((qpoints[start:start + chunk], weights[start:start + chunk], grid, factor, chunk)
+             for start in range(0, len(qpoints), chunk))
+
+    hist = numpy.zeros(grid[2])
+    if processes == 1 or len(qpoints) <= chunk:
+        for task in tasks:
+            hist += bin_frequencies(dynmat, *task)
+    else:
+        for part in pool_results(dynmat, bin_frequencies, tasks, processes):
+            hist += part
+
+    return dos_broadening.smooth(hist, grid[1], grid[3], grid[4], sigma, N, kernel)
+
+###############################################
+#
+#    Linear tetrahedron method (Bloechl, Jepsen and
+#    Andersen, PRB 49, 16223): every mesh cell is cut
+#    into six tetrahedra along its shortest diagonal,
+#    frequencies are linear inside each one and the
+#    DOS is integrated exactly, with no sigma.
+#
+###############################################
+
+# six tetrahedra around the 0-7 diagonal of a cell whose corners are
+# numbered 4*i + 2*j + k for offsets (i, j, k) in {0, 1}
+CORNERS = numpy.array(list(itertools.product((0, 1), repeat=3)))
+MAIN_TETRAHEDRA = numpy.array([[0, 1, 3, 7], [0, 1, 5, 7], [0, 2, 3, 7],
+                               [0, 2, 6, 7], [0, 4, 5, 7], [0, 4, 6, 7]])
+
+def tetrahedra(mesh, lattice):
+    # (6 * n_q, 4) mesh indices of the corners of every tetrahedron
+    mesh = numpy.array(mesh, dtype=int)
+    reciprocal = numpy.linalg.inv(numpy.asarray(lattice, dtype=float)).T / mesh[:, None]
+    diagonals = numpy.arange(4)
+    lengths = numpy.linalg.norm((CORNERS[7 - diagonals] - CORNERS[diagonals]).dot(reciprocal), axis=1)
+    corners = CORNERS[MAIN_TETRAHEDRA ^ diagonals[numpy.argmin(lengths)]]
+    grid = numpy.indices(mesh).reshape(3, -1).T
+    points = (grid[:, None, None, :] + corners[None, :, :, :]) % mesh
+    return numpy.ravel_multi_index(points.reshape(-1, 3).T, mesh).reshape(-1, 4)
+
+def tetrahedron_weights(x, e):
+    # DOS at x from tetrahedra with sorted corner values e (n, 4), each of
+    # unit volume; returns (n, len(x))
+    e1, e2, e3, e4 = [e[:, i, None] for i in range(4)]
+    x = x[None, :]
+    g = numpy.zeros((len(e), x.shape[1]))
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        low = (e1 < x) & (x <= e2)
+        value = 3 * (x - e1)**2 / ((e2 - e1) * (e3 - e1) * (e4 - e1))
+        g[low] = numpy.broadcast_to(value, g.shape)[low]
+        middle = (e2 < x) & (x <= e3)
+        value = (3 * (e2 - e1) + 6 * (x - e2)
+                 - 3 * (e3 - e1 + e4 - e2) * (x - e2)**2 / ((e3 - e2) * (e4 - e2))) / ((e3 - e1) * (e4 - e1))
+        g[middle] = numpy.broadcast_to(value, g.shape)[middle]
+        high = (e3 < x) & (x < e4)
+        value = 3 * (e4 - x)**2 / ((e4 - e1) * (e4 - e2) * (e4 - e3))
+        g[high] = numpy.broadcast_to(value, g.shape)[high]
+    return g
+
+def tetrahedron_dos(x, frequencies, mesh, lattice, N=1, chunk=2**22):
+    # frequencies (n_q, bands) on the full mesh in mpmesh order; the
+    # result integrates to bands / N
+    x = numpy.asarray(x, dtype=float)
+    frequencies = numpy.asarray(frequencies, dtype=float)
+    corners = tetrahedra(mesh, lattice)
+    e = numpy.sort(frequencies[corners], axis=1)  # (n_tetra, 4, bands)
+    e = e.transpose(0, 2, 1).reshape(-1, 4)
+    volume = 1.0 / len(corners)
+
+    # flat bands and degenerate corners give tetrahedra narrower than the
+    # grid, whose delta-like weight the formulas below would miss or
+    # sample badly; they go onto the grid at their mean frequency instead
+    order = numpy.argsort(x)
+    xs = x[order]
+    narrow = e[:, 3] - e[:, 0] < numpy.amin(numpy.diff(xs), initial=numpy.inf)
+    func = numpy.zeros(len(x))
+    func[order] = deposit(xs, e[narrow].mean(axis=1))
+    e = e[~narrow]
+    e = e[numpy.argsort(e[:, 0])]
+
+    rows = max(1, chunk // max(1, len(x)))
+    for start in range(0, len(e), rows):
+        block = e[start:start + rows]
+        lo = numpy.searchsorted(xs, block[:, 0].min(), side="left")
+        hi = numpy.searchsorted(xs, block[:, 3].max(), side="right")
+        if hi > lo:
+            func[order[lo:hi]] += tetrahedron_weights(xs[lo:hi], block).sum(axis=0)
+    return func * volume / N
+
+def deposit(xs, points):
+    # unit weights at points as a density on the sorted grid xs: split
+    # linearly between the two neighbouring grid points (as in
+    # dos_broadening.histogram) and divided by each point's share of
+    # the trapezoid rule, so the result integrates to len(points)
+    func = numpy.zeros(len(xs))
+    if len(xs) < 2:
+        return func
+    i = numpy.searchsorted(xs, points, side="right") - 1
+    inside = (i >= 0) & (i < len(xs) - 1)
+    inside |= points == xs[-1]
+    i = numpy.minimum(i[inside], len(xs) - 2)
+    f = (points[inside] - xs[i]) / (xs[i + 1] - xs[i])
+    numpy.add.at(func, i, 1 - f)
+    numpy.add.at(func, i + 1, f)
+    share = 0.5 * (numpy.append(xs[1:], xs[-1]) - numpy.insert(xs[:-1], 0, xs[0]))
+    return func / share
+
+def mesh_tetrahedron_dos(dynmat, mesh, x, N=None, rotations=None, shift=(0, 0, 0),
+                         factor=1, processes=None, chunk=256):
+    # tetrahedron DOS of the dynamical matrix, diagonalizing only the
+    # irreducible points; integrates to 3 * natom / N (1 by default)
+    if N is None:
+        N = 3 * dynmat.natom
+    representative = mesh_map(mesh, rotations, shift)
+    points, inverse = numpy.unique(representative, return_inverse=True)
+    qpoints = phonon_qpoints.mpmesh(mesh, shift)[points]
+    frequencies = mesh_frequencies(dynmat, qpoints, factor, processes, chunk)
+    return tetrahedron_dos(x, frequencies[inverse.ravel()], mesh, dynmat.lattice, N)
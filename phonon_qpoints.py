@@ -0,0 +1,109 @@
+###############################################
+#
+#    script: phonon_qpoints.py
+#
+#    Author: Paul Sanders (phs0007@auburn.edu)
+#
+#    Purpose: Mass-weighted dynamical matrices D(q)
+#             of the primitive cell from supercell
+#             force constants, for a batch of q-points
+#
+#    Input: 1. primitive cell (poscar_gen.Poscar)
+#           2. supercell matrix T used by poscar_gen
+#           3. (N, N, 3, 3) supercell force constants
+#              with the atom order of poscar_gen's
+#              supercell (basis atom outermost)
+#           4. masses per species or per atom
+#
+#    D_ab(q) = sum_t Phi(a0, b_t) / sqrt(m_a m_b)
+#              * exp(2 pi i q.(x_b + t - x_a))
+#    using the shortest image of each supercell atom
+#    (equidistant images share the weight).
+#
+#    Frequencies are sqrt(eigenvalue), negative for
+#    unstable modes, times factor (VaspToTHz gives
+#    THz for eV/A^2 and amu).
+#
+###############################################
+
+import numpy
+import poscar_gen
+
+VaspToTHz = 15.633302
+
+class DynamicalMatrix:
+
+    def __init__(self, primitive, T, force_constants, masses=None, translations=None, tol=1e-5):
+        T = poscar_gen.getT(T)
+        nsuper = int(round(numpy.linalg.det(T)))
+        natom = primitive.natoms
+        force_constants = numpy.asarray(force_constants, dtype=float)
+        if force_constants.shape[:2] != (natom * nsuper, natom * nsuper):
+            raise ValueError("Force constants are {} but the supercell has {} atoms".format(
+                force_constants.shape[:2], natom * nsuper))
+        if translations is None:
+            lattice = poscar_gen.getnewunitvectors(nsuper, poscar_gen.T2R(T))
+            translations = numpy.rint(lattice.dot(T.T))
+        translations = numpy.asarray(translations, dtype=float)
+        origin = numpy.nonzero(numpy.all(translations == 0, axis=1))[0][0]
+
+        self.natom = natom
+        self.masses = get_masses(primitive, masses)
+        self.lattice = primitive.lattice * primitive.scale
+
+        # every (a, b, t) separation and its 27 supercell images, in primitive
+        # fractional coordinates; keep the shortest ones
+        x = primitive.positions
+        images = numpy.array([[i, j, k] for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)]).dot(T.T)
+        d = (x[None, :, None, None, :] + translations[None, None, :, None, :]
+             + images[None, None, None, :, :] - x[:, None, None, None, :])
+        length = numpy.linalg.norm(d.dot(self.lattice), axis=-1)
+        shortest = length <= length.min(axis=-1, keepdims=True) + tol
+        weight = shortest / shortest.sum(axis=-1, keepdims=True)
+
+        a, b, t, image = numpy.nonzero(weight)
+        blocks = force_constants[a * nsuper + origin, b * nsuper + t]
+        blocks = blocks / numpy.sqrt(self.masses[a] * self.masses[b])[:, None, None]
+        self.pairs = a * natom + b
+        self.vectors = d[a, b, t, image]
+        self.blocks = blocks * weight[a, b, t, image][:, None, None]
+
+    def __call__(self, qpoints):
+        # (n_q, 3) q in reciprocal fractional coordinates -> (n_q, 3N, 3N)
+        qpoints = numpy.atleast_2d(numpy.asarray(qpoints, dtype=float))
+        phase = numpy.exp(2j * numpy.pi * qpoints.dot(self.vectors.T))
+        dynmat = numpy.zeros((len(qpoints), self.natom * self.natom, 9), dtype=complex)
+        for pair in numpy.unique(self.pairs):
+            k = self.pairs == pair
+            dynmat[:, pair] = phase[:, k].dot(self.blocks[k].reshape(-1, 9))
+        dynmat = dynmat.reshape(len(qpoints), self.natom, self.natom, 3, 3)
+        dynmat = dynmat.transpose(0, 1, 3, 2, 4).reshape(len(qpoints), 3 * self.natom, 3 * self.natom)
+        return 0.5 * (dynmat + dynmat.conj().transpose(0, 2, 1))
+
+    def eigenvalues(self, qpoints, chunk=256):
+        qpoints = numpy.atleast_2d(numpy.asarray(qpoints, dtype=float))
+        values = numpy.zeros((len(qpoints), 3 * self.natom))
+        for start in range(0, len(qpoints), chunk):
+            values[start:start + chunk] = numpy.linalg.eigvalsh(self(qpoints[start:start + chunk]))
+        return values
+
+    def frequencies(self, qpoints, factor=1, chunk=256):
+        values = self.eigenvalues(qpoints, chunk)
+        return numpy.sign(values) * numpy.sqrt(numpy.abs(values)) * factor
+
+def get_masses(primitive, masses):
+    if masses is None:
+        return numpy.ones(primitive.natoms)
+    masses = numpy.asarray(masses, dtype=float)
+    if masses.size == len(primitive.counts):
+        return numpy.repeat(masses, primitive.counts)
+    if masses.size == primitive.natoms:
+        return masses
+    raise ValueError("Give one mass per species or one per atom")
+
+def mpmesh(mesh, shift=(0, 0, 0)):
+    # Monkhorst-Pack grid (2r - n + 1)/2n in reciprocal fractional
+    # coordinates, shift in units of the grid spacing
+    mesh = numpy.array(mesh, dtype=int)
+    grid = numpy.indices(mesh).reshape(3, -1).T
+    return (2 * grid - mesh + 1 + 2 * numpy.asarray(shift, dtype=float)) / (2.0 * mesh)
@@ -0,0 +1,141 @@
+###############################################
+#
+#    script: phonon_thermodynamics.py
+#
+#    Author: Paul Sanders (phs0007@auburn.edu)
+#
+#    Purpose: Harmonic phonon free energy, energy,
+#             entropy and heat capacity for a whole
+#             temperature array at once
+#
+#    Input: a density of states from test.import_data
+#           (columns omega, density) or raw frequencies
+#
+#    With x = hbar * omega / (kb * T):
+#       F  = sum g * (hbar*omega/2 + kb*T*log(1 - exp(-x)))
+#       E  = sum g * (hbar*omega/2 + hbar*omega*n),  n = 1/(exp(x) - 1)
+#       S  = (E - F) / T
+#       Cv = sum g * kb * x**2 * exp(x)/(exp(x) - 1)**2
+#    Every term is written with exp(-x), expm1 and log1p
+#    so large x never overflows; T = 0 gives the
+#    zero-point limit (S = Cv = 0). Modes with omega <=
+#    ZERO_MODE * max(omega) are left out: acoustic modes
+#    that are zero up to round-off (omega ~ 1e-7 after
+#    symmetrizing) would otherwise add kb*T*log(x) each.
+#
+#    A spectrum cut off at omega_c (partial eigen-solve)
+#    is completed with tail_modes(): the missing modes
+#    are replaced by lumps that reproduce their number
+#    and the power traces Tr D**k of the dynamical matrix
+#    (two-node Gauss quadrature in omega**2 for k <= 3,
+#    Gauss-Radau with a node at omega_c for k <= 2, the
+#    rms frequency for k = 1). Their thermal terms go as
+#    exp(-hbar*omega_c/(kb*T)), so at low T this mostly
+#    corrects the zero-point energy.
+#
+###############################################
+
+import numpy
+
+# relative frequency below which a mode counts as zero (acoustic)
+ZERO_MODE = 1e-5
+
+def from_dos(temp, density_of_states, hbar=1, kb=1, chunk=2**22):
+    density_of_states = numpy.asarray(density_of_states, dtype=float)
+    omega = density_of_states[:, 0]
+    density = density_of_states[:, 1]
+    return get_thermodynamics(temp, omega, density, hbar, kb, chunk)
+
+def from_frequencies(temp, frequencies, hbar=1, kb=1, chunk=2**22, tail=None):
+    # tail = (counts, omegas) from tail_modes for a truncated spectrum
+    frequencies = numpy.ravel(numpy.asarray(frequencies, dtype=float))
+    density = numpy.ones(len(frequencies))
+    if tail is not None:
+        frequencies = numpy.append(frequencies, tail[1])
+        density = numpy.append(density, tail[0])
+    return get_thermodynamics(temp, frequencies, density, hbar, kb, chunk)
+
+def tail_modes(frequencies, total_modes, traces, cap=None):
+    # (counts, omegas) standing in for the modes missing from a spectrum
+    # cut off at cap; traces = (Tr D, Tr D**2, Tr D**3), or fewer, over
+    # all modes, i.e. sums of omega**2, omega**4, omega**6
+    frequencies = numpy.ravel(numpy.asarray(frequencies, dtype=float))
+    count = total_modes - len(frequencies)
+    if count <= 0:
+        return numpy.zeros(0), numpy.zeros(0)
+    lam = frequencies**2
+    m = [float(count)] + [max(trace - numpy.sum(lam**k), 0.0)
+                          for k, trace in enumerate(numpy.atleast_1d(traces), 1)]
+    lumped = numpy.array([count], dtype=float), numpy.sqrt([m[1] / count])
+    a = cap**2 if cap is not None else numpy.amax(lam, initial=0)
+
+    if len(m) > 3:
+        # nodes are the roots of x**2 + b x + c, orthogonal to 1 and x
+        try:
+            b, c = numpy.linalg.solve([[m[1], m[0]], [m[2], m[1]]], [-m[2], -m[3]])
+            nodes = numpy.roots([1, b, c])
+            if numpy.all(numpy.isreal(nodes)) and numpy.amin(nodes.real) > 0:
+                nodes = numpy.maximum(nodes.real, a)
+                weights = numpy.linalg.solve([[1, 1], nodes], m[:2])
+                if numpy.all(weights >= 0):
+                    return weights, numpy.sqrt(nodes)
+        except numpy.linalg.LinAlgError:
+            pass
+    if len(m) > 2:
+        # one node fixed at the cut: moments of u = omega**2 - a
+        u1 = m[1] - a * m[0]
+        u2 = m[2] - 2 * a * m[1] + a * a * m[0]
+        if u1 > 0 and u2 > 0:
+            weight = min(u1 * u1 / u2, count)
+            return numpy.array([count - weight, weight]), numpy.sqrt([a, a + u2 / u1])
+    return lumped
+
+def check_zero_modes(temp, frequencies, tol=1e-9, hbar=1, kb=1):
+    # the results must not change when the modes at or below the zero-mode
+    # cutoff are set to exactly 0; error is relative to the largest |F|
+    frequencies = numpy.ravel(numpy.asarray(frequencies, dtype=float))
+    exact = numpy.where(frequencies > ZERO_MODE * numpy.amax(frequencies, initial=0),
+                        frequencies, 0.0)
+    results = from_frequencies(temp, frequencies, hbar, kb)
+    reference = from_frequencies(temp, exact, hbar, kb)
+    scale = numpy.amax(numpy.abs(reference[0]))
+    if scale == 0:
+        scale = 1
+    error = max(numpy.amax(numpy.abs(a - b)) for a, b in zip(results, reference)) / scale
+    return error <= tol, error
+
+def get_thermodynamics(temp, omega, density, hbar=1, kb=1, chunk=2**22):
+    # returns free energy, energy, entropy, heat capacity with the shape of temp
+    temp = numpy.asarray(temp, dtype=float)
+    shape = temp.shape
+    temp = numpy.ravel(temp)
+    omega = numpy.asarray(omega, dtype=float)
+    density = numpy.asarray(density, dtype=float)
+    keep = omega > ZERO_MODE * numpy.amax(omega, initial=0)
+    omega = omega[keep]
+    density = density[keep]
+
+    zero_point = numpy.sum(density * hbar * omega * 0.5)
+    free_energy = numpy.full(len(temp), zero_point)
+    energy = numpy.full(len(temp), zero_point)
+    entropy = numpy.zeros(len(temp))
+    heat_capacity = numpy.zeros(len(temp))
+
+    # evaluate the (temperature x frequency) grid a block of rows at a time
+    hot = numpy.nonzero(temp > 0)[0]
+    rows = max(1, chunk // max(1, len(omega)))
+    for start in range(0, len(hot), rows):
+        index = hot[start:start + rows]
+        T = temp[index][:, None]
+        x = hbar * omega[None, :] / (kb * T)
+        emx = numpy.exp(-x)
+        one_minus = -numpy.expm1(-x)
+        n = emx / one_minus
+        log_term = numpy.log1p(-emx)
+        free_energy[index] += (density * kb * T * log_term).sum(axis=1)
+        energy[index] += (density * hbar * omega * n).sum(axis=1)
+        entropy[index] = (density * kb * (x * n - log_term)).sum(axis=1)
+        heat_capacity[index] = (density * kb * x**2 * emx / one_minus**2).sum(axis=1)
+
+    return (free_energy.reshape(shape), energy.reshape(shape),
+            entropy.reshape(shape), heat_capacity.reshape(shape))
@@ -1,89 +1,587 @@
-fc_and_atom_types = read_force_constant_vasprun_xml(filename)
-
-def parse_FORCE_CONSTANTS(filename="FORCE_CONSTANTS"):
-    fcfile = open(filename)
-    num = int((fcfile.readline().strip().split())[0])
-    force_constants = np.zeros((num, num, 3, 3), dtype=float)
-    for i in range(num):
-        for j in range(num):
-            fcfile.readline()
-            tensor = []
-            for k in range(3):
-                tensor.append([float(x) for x in fcfile.readline().strip().split()])
-            force_constants[i, j] = np.array(tensor)
+import os
+import sys
+import gzip
+import lzma
+import json
+import time
+import io
+import hashlib
+import itertools
+import numpy as np
 
+# Usage:
+#   force_constants = load_FORCE_CONSTANTS("FORCE_CONSTANTS")
+#   force_constants = parse_FORCE_CONSTANTS("FORCE_CONSTANTS")
+#   fc_and_atom_types = read_force_constant_vasprun_xml(filename)
+#   write_FORCE_CONSTANTS(force_constants, "FORCE_CONSTANTS.gz", upper=True)
+#   force_constants = symmetrize_force_constants(force_constants, report=True)
+#   hessian = fc_to_hessian(force_constants)      # (3N, 3N)
+#   force_constants = hessian_to_fc(hessian)      # (N, N, 3, 3) view
+#   python phonopy_force_constants.py vasprun.xml [FORCE_CONSTANTS] [binary]
+
+def parse_FORCE_CONSTANTS(filename="FORCE_CONSTANTS", chunk_blocks=None,
+                          out=None, report=False):
+    """Read a FORCE_CONSTANTS file into an (N, N, 3, 3) array.
+
+    Every block is the "i j" line followed by three rows of the 3x3
+    tensor, so the body is tokenized in bulk and reshaped to
+    (n_blocks, 11) instead of converting values one at a time.
+    gzip and xz files are read transparently, and so are the compact
+    files of write_FORCE_CONSTANTS: blocks may be missing (zero) and
+    "upper" files give only j >= i.
+
+    chunk_blocks: parse this many blocks at a time to bound memory
+                  (None reads the whole body at once)
+    out: preallocated (N, N, 3, 3) or (3N, 3N) float64 buffer, e.g. a
+         np.memmap, or a path for a memory-mapped .npy file
+    report: print the parse throughput in lines/sec
+    """
+    start = time.time()
+    with _open(filename, 'rt') as fcfile:
+        header = fcfile.readline().split()
+        num = int(header[0])
+        force_constants = _get_fc_buffer(num, out)
+        if 'upper' in header or 'sparse' in header:
+            force_constants[...] = 0
+        nlines = 1
+        if chunk_blocks is None:
+            nlines += _fill_blocks(force_constants, fcfile.read())
+        else:
+            while True:
+                lines = list(itertools.islice(fcfile, 4 * chunk_blocks))
+                if not lines:
+                    break
+                nlines += _fill_blocks(force_constants, "".join(lines))
+
+    if 'upper' in header:
+        # lower blocks are the transposes of the upper ones
+        for i in range(1, num):
+            force_constants[i, :i] = force_constants[:i, i].swapaxes(1, 2)
+
+    if report:
+        elapsed = max(time.time() - start, 1e-12)
+        print("Parsed %d lines from %s in %.3f s (%.0f lines/sec)" %
+              (nlines, filename, elapsed, nlines / elapsed))
     return force_constants
 
+def _get_fc_buffer(num, out):
+    shape = (num, num, 3, 3)
+    if out is None:
+        return np.zeros(shape, dtype='double')
+    if isinstance(out, str):
+        return np.lib.format.open_memmap(out, mode='w+', dtype='double',
+                                         shape=shape)
+    if out.shape == (3 * num, 3 * num):
+        out = hessian_to_fc(out)
+    if out.shape != shape or out.dtype != np.dtype('double'):
+        raise ValueError("Buffer for force constants must be float64 with "
+                         "shape %s" % (shape,))
+    return out
+
+def _fill_blocks(force_constants, text):
+    index, blocks = _read_blocks(text)
+    force_constants[index[:, 0], index[:, 1]] = blocks
+    return 4 * len(blocks)
+
+def _read_blocks(text):
+    # (n, 2) zero-based atom pairs and (n, 3, 3) blocks of a body chunk
+    values = np.fromstring(text, sep=" ")
+    if values.size % 11 != 0:
+        raise ValueError("FORCE_CONSTANTS body is not made of "
+                         "'i j' + 3x3 blocks")
+    values = values.reshape(-1, 11)
+    index = values[:, :2].astype(np.intp) - 1
+    return index, values[:, 2:].reshape(-1, 3, 3)
+
+def _iter_blocks(source, chunk_blocks=65536):
+    # (num, upper) first, then (index, blocks) chunks of a file or array
+    if isinstance(source, str):
+        with _open(source, 'rt') as fcfile:
+            header = fcfile.readline().split()
+            yield int(header[0]), 'upper' in header
+            while True:
+                lines = list(itertools.islice(fcfile, 4 * chunk_blocks))
+                if not lines:
+                    break
+                yield _read_blocks("".join(lines))
+    else:
+        force_constants = _as_fc(source)
+        num = force_constants.shape[0]
+        yield num, False
+        rows = max(1, chunk_blocks // num)
+        for start in range(0, num, rows):
+            block_rows = np.arange(start, min(start + rows, num))
+            index = np.stack(np.broadcast_arrays(block_rows[:, None],
+                                                 np.arange(num)[None, :]),
+                             axis=-1).reshape(-1, 2)
+            yield index, np.asarray(
+                force_constants[block_rows]).reshape(-1, 3, 3)
+
+def hessian_to_fc(hessian):
+    """(3N, 3N) Hessian -> (N, N, 3, 3) tensor of 3x3 blocks.
+
+    Always a view: writing to it writes to the Hessian.
+    """
+    num = hessian.shape[0] // 3
+    if hessian.shape != (3 * num, 3 * num):
+        raise ValueError("Hessian must be (3N, 3N), not %s" %
+                         (hessian.shape,))
+    return hessian.reshape(num, 3, num, 3).swapaxes(1, 2)
+
+def fc_to_hessian(force_constants):
+    """(N, N, 3, 3) tensor -> (3N, 3N) Hessian.
+
+    A view when the blocks are laid out as a Hessian already (e.g. the
+    result of hessian_to_fc), otherwise a single copy.
+    """
+    num = force_constants.shape[0]
+    if force_constants.shape != (num, num, 3, 3):
+        raise ValueError("Force constants must be (N, N, 3, 3), not %s" %
+                         (force_constants.shape,))
+    return force_constants.swapaxes(1, 2).reshape(3 * num, 3 * num)
+
+def _as_fc(force_constants):
+    # accept either layout, return the (N, N, 3, 3) one
+    force_constants = np.asarray(force_constants)
+    if force_constants.ndim == 2:
+        return hessian_to_fc(force_constants)
+    return force_constants
+
+
+def force_constant_errors(force_constants):
+    """Largest |Phi_ij - Phi_ji^T| and largest |sum_j Phi_ij|."""
+    force_constants = _as_fc(force_constants)
+    asymmetry = np.abs(force_constants -
+                       force_constants.transpose(1, 0, 3, 2)).max()
+    drift = np.abs(force_constants.sum(axis=1)).max()
+    return asymmetry, drift
 
-def write_FORCE_CONSTANTS(force_constants, filename='FORCE_CONSTANTS'):
-    w = open(filename, 'w')
-    fc_shape = force_constants.shape
-    w.write("%4d\n" % (fc_shape[0]))
-    for i in range(fc_shape[0]):
-        for j in range(fc_shape[1]):
-            w.write("%4d%4d\n" % (i+1, j+1))
-            for vec in force_constants[i][j]:
-                w.write(("%22.15f"*3 + "\n") % tuple(vec))
-    w.close()
+def symmetrize_force_constants(force_constants, report=False):
+    """Return force constants with Phi_ij = Phi_ji^T and
+    sum_j Phi_ij = sum_i Phi_ij = 0 (acoustic sum rule).
+
+    The symmetric part S is projected as P.S.P with P = I - 11^T/N on
+    the atom indices, i.e. S_ij - R_i/N - R_j^T/N + T/N**2 with R_i the
+    row sums and T the total. This is the smallest (Frobenius) change
+    that satisfies both conditions; it takes O(N**2) array operations
+    and keeps the Gamma-point acoustic modes at zero.
+    report: print the largest change made by each step
+    """
+    force_constants = _as_fc(force_constants)
+    num = force_constants.shape[0]
+    symmetric = 0.5 * (force_constants +
+                       force_constants.transpose(1, 0, 3, 2))
+    rows = symmetric.sum(axis=1)
+    total = rows.sum(axis=0)
+    if report:
+        scale = np.abs(force_constants).max()
+        asymmetry = np.abs(symmetric - force_constants).max()
+
+    symmetric -= rows[:, None] / num
+    symmetric -= rows.transpose(0, 2, 1)[None, :] / num
+    symmetric += total / num ** 2
+
+    if report:
+        correction = np.abs(rows[:, None] / num +
+                            rows.transpose(0, 2, 1)[None, :] / num -
+                            total / num ** 2).max()
+        print("Symmetrized force constants: largest change %.3e "
+              "(symmetry) and %.3e (sum rule), largest |Phi| %.3e" %
+              (asymmetry, correction, scale))
+    return symmetric
+
+def sparse_force_constants(source, cutoff=0.0, distance=None, poscar=None,
+                           chunk_blocks=65536, report=False):
+    """Return the force constants as a (3N, 3N) scipy.sparse.bsr_matrix
+    of 3x3 blocks, without building the dense matrix.
+
+    source: FORCE_CONSTANTS file (any variant parse_FORCE_CONSTANTS
+            reads) or an (N, N, 3, 3) / (3N, 3N) array; files are read
+            chunk_blocks blocks at a time
+    cutoff: drop off-diagonal blocks whose largest |value| is <= cutoff
+    distance: also drop pairs further apart than this (Angstrom) in the
+              supercell poscar (a poscar_gen.Poscar), nearest image by
+              rounding the fractional separation
+    Each unordered pair i < j is kept if either Phi_ij or Phi_ji passes,
+    and stored as 0.5 * (Phi_ij + Phi_ji^T) (Phi_ji^T alone when the
+    other one was dropped, i.e. is below cutoff), so the matrix is
+    symmetric even for unsymmetrized input. The diagonal blocks are
+    rebuilt from the kept blocks with the acoustic sum rule,
+    Phi_ii = -sym(sum_j!=i Phi_ij), so dropping blocks does not open a
+    gap at Gamma.
+    """
+    import scipy.sparse
+
+    chunks = _iter_blocks(source, chunk_blocks)
+    num, upper = next(chunks)
+    if distance is not None:
+        positions = poscar.positions
+        lattice = poscar.lattice * poscar.scale
+
+    # every kept block is stored under its pair (a, b), a < b, as Phi_ab
+    # or Phi_ba^T; an upper file (compact layout) has Phi_ab only
+    pairs, data = [], []
+    diagonal = np.zeros((num, 3, 3))
+    for index, blocks in chunks:
+        i, j = index[:, 0], index[:, 1]
+        on_site = i == j
+        diagonal[i[on_site]] = blocks[on_site]
+        keep = ~on_site & (np.abs(blocks).max(axis=(1, 2)) > cutoff)
+        if distance is not None:
+            d = positions[j] - positions[i]
+            d -= np.rint(d)
+            keep &= np.linalg.norm(d.dot(lattice), axis=1) <= distance
+        i, j, blocks = i[keep], j[keep], blocks[keep]
+        lower = i > j
+        blocks[lower] = blocks[lower].swapaxes(1, 2)
+        pairs.append(np.minimum(i, j).astype(np.int64) * num + np.maximum(i, j))
+        data.append(blocks)
+    pairs = np.concatenate(pairs)
+    data = np.concatenate(data)
+
+    if upper:
+        # one block per pair, Phi_ba = Phi_ab^T by construction
+        order = np.argsort(pairs)
+        pairs, data = pairs[order], data[order]
+    else:
+        # average the orientations found for each pair
+        order = np.argsort(pairs, kind='stable')
+        pairs, starts, counts = np.unique(pairs[order], return_index=True,
+                                          return_counts=True)
+        if len(pairs):
+            data = (np.add.reduceat(data[order], starts) /
+                    counts[:, None, None])
+    rows = np.concatenate((pairs // num, pairs % num))
+    cols = np.concatenate((pairs % num, pairs // num))
+    data = np.concatenate((data, data.swapaxes(1, 2)))
+
+    sums = np.zeros((num, 3, 3))
+    np.add.at(sums, rows, data)
+    on_site = -0.5 * (sums + sums.swapaxes(1, 2))
+    rows = np.concatenate((rows, np.arange(num)))
+    cols = np.concatenate((cols, np.arange(num)))
+    data = np.concatenate((data, on_site))
+
+    order = np.lexsort((cols, rows))
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=num))))
+    array = scipy.sparse.bsr_matrix((data[order], cols[order], indptr),
+                                    shape=(3 * num, 3 * num))
+    if report:
+        print("Kept %d of %d blocks (%.2f%%); largest change of an "
+              "on-site block %.3e" %
+              (len(data), num * num, 100.0 * len(data) / num ** 2,
+               np.abs(on_site - diagonal).max()))
+    return array
+
+def load_FORCE_CONSTANTS(filename="FORCE_CONSTANTS", cache=True,
+                         mmap_mode='r'):
+    """Return the (N, N, 3, 3) force constants of a text or .npy file.
+
+    Text files are parsed once into a sidecar cache
+    (filename + ".cache.npy") described by filename + ".cache.json".
+    The cache is reused while the file size and mtime match; if only
+    the mtime changed, the content hash decides. Stale caches are
+    rebuilt transparently; if the sidecar cannot be written (e.g. a
+    read-only directory) the file is parsed without one.
+    """
+    if _is_npy(filename):
+        with _open(filename, 'rb') as f:
+            if not isinstance(f, io.BufferedReader):
+                # compressed .npy, cannot be memory-mapped
+                return np.load(f)
+        return np.load(filename, mmap_mode=mmap_mode)
+    if not cache:
+        return parse_FORCE_CONSTANTS(filename)
+
+    cachefile, metafile = _cache_names(filename)
+    stat = os.stat(filename)
+    meta = _read_cache_meta(metafile)
+    if meta is not None and os.path.isfile(cachefile) and \
+       meta['size'] == stat.st_size:
+        if meta['mtime'] == stat.st_mtime:
+            return np.load(cachefile, mmap_mode=mmap_mode)
+        digest = _file_hash(filename)
+        if meta['sha256'] == digest:
+            try:
+                _write_cache_meta(metafile, stat, digest)
+            except OSError:
+                pass
+            return np.load(cachefile, mmap_mode=mmap_mode)
+
+    try:
+        _build_cache(filename, cachefile, metafile)
+    except OSError:
+        # no sidecar possible (read-only directory, disk full): parse
+        # into memory instead
+        return parse_FORCE_CONSTANTS(filename)
+    return np.load(cachefile, mmap_mode=mmap_mode)
+
+def _cache_names(filename):
+    return filename + ".cache.npy", filename + ".cache.json"
+
+def _open(filename, mode='rt'):
+    # plain, gzip or xz file, recognized by its magic bytes when reading
+    # and by its extension when writing
+    if 'r' in mode:
+        with open(filename, 'rb') as f:
+            magic = f.read(6)
+        compressed = {b'\x1f\x8b': 'gz', b'\xfd7zXZ': 'xz'}
+        kind = compressed.get(magic[:2]) or compressed.get(magic[:5])
+    else:
+        kind = os.path.splitext(filename)[1].lstrip('.')
+    if kind == 'gz':
+        return gzip.open(filename, mode, compresslevel=6) if 'w' in mode \
+            else gzip.open(filename, mode)
+    if kind == 'xz':
+        return lzma.open(filename, mode)
+    return open(filename, mode)
+
+def _is_npy(filename):
+    with _open(filename, 'rb') as f:
+        return f.read(6) == b'\x93NUMPY'
+
+def _file_hash(filename, blocksize=1 << 20):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _read_cache_meta(metafile):
+    try:
+        with open(metafile) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def _write_cache_meta(metafile, stat, digest):
+    tmpfile = metafile + ".tmp"
+    with open(tmpfile, 'w') as f:
+        json.dump({'size': stat.st_size,
+                   'mtime': stat.st_mtime,
+                   'sha256': digest}, f)
+    os.replace(tmpfile, metafile)
+
+def _build_cache(filename, cachefile, metafile):
+    # parse straight into the memory-mapped .npy, then swap it in
+    stat = os.stat(filename)
+    digest = _file_hash(filename)
+    tmpfile = cachefile + ".tmp.npy"
+    try:
+        force_constants = parse_FORCE_CONSTANTS(filename, out=tmpfile)
+        force_constants.flush()
+        del force_constants
+        os.replace(tmpfile, cachefile)
+    except OSError:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        raise
+    _write_cache_meta(metafile, stat, digest)
+
+def write_FORCE_CONSTANTS(force_constants, filename='FORCE_CONSTANTS',
+                          binary=False, upper=False, cutoff=None,
+                          chunk_blocks=4096):
+    """Write force constants in the phonopy text format.
+
+    force_constants may also be a (3N, 3N) Hessian. A ".gz" or ".xz"
+    filename is compressed. Blocks are formatted chunk_blocks at a time
+    with one format string.
+
+    binary: write .npy instead, read back directly by
+            load_FORCE_CONSTANTS
+    upper: keep only the blocks with j >= i (the matrix is symmetric)
+    cutoff: leave out blocks whose largest |value| is <= cutoff
+            (0 drops exact zero blocks)
+    Files written with upper or cutoff are marked "upper" / "sparse"
+    on the first line; parse_FORCE_CONSTANTS restores the full matrix.
+    """
+    force_constants = _as_fc(force_constants)
+    if binary:
+        with _open(filename, 'wb') as w:
+            np.save(w, np.asarray(force_constants, dtype='double'))
+        return
+
+    num = force_constants.shape[0]
+    keep = np.ones((num, num), dtype=bool)
+    if upper:
+        keep = np.triu(keep)
+    if cutoff is not None:
+        largest = np.abs(force_constants).max(axis=(2, 3))
+        keep &= largest > cutoff
+        keep[np.arange(num), np.arange(num)] = True
+    i, j = np.nonzero(keep)
+
+    header = "%4d" % num
+    if upper:
+        header += " upper"
+    if cutoff is not None:
+        header += " sparse"
+    # "%4d%4d" runs the indices together from 10000 atoms on
+    pair = "%4d%4d\n" if num < 10000 else "%d %d\n"
+    block = pair + ("%22.15f" * 3 + "\n") * 3
+    with _open(filename, 'wt') as w:
+        w.write(header + "\n")
+        for start in range(0, len(i), chunk_blocks):
+            ic = i[start:start + chunk_blocks]
+            jc = j[start:start + chunk_blocks]
+            values = np.empty((len(ic), 11))
+            values[:, 0] = ic + 1
+            values[:, 1] = jc + 1
+            values[:, 2:] = force_constants[ic, jc].reshape(-1, 9)
+            w.write((block * len(ic)) % tuple(values.ravel().tolist()))
 
 def read_force_constant_vasprun_xml(filename):
     vasprun = _parse_vasprun_xml(filename)
     return get_force_constants_vasprun_xml(vasprun)
 
 def get_force_constants_vasprun_xml(vasprun):
-    fc_tmp = None
-    num_atom = 0
+    """Return (force_constants, elements) from iterparse events.
+
+    vasprun yields ("start" | "end", element) pairs. Each element is
+    cleared and detached from its parent once it has been used, so
+    memory does not grow with the size of vasprun.xml. The <v> rows of
+    the mass-normalized Hessian are parsed straight into a (3N, 3N)
+    buffer and un-normalized with one broadcast multiply.
+    Returns False if there is no Hessian of the right shape.
+    """
+    stack = []
+    masses = None
+    elements = None
+    hessian = None
+    row = 0
+    in_atomtypes = False
+    in_hessian = False
     for event, element in vasprun:
-        if num_atom == 0:
-            atomtypes = _get_atomtypes_from_vasprun_xml(element)
-            if atomtypes:
-                num_atoms, elements, elem_masses = atomtypes[:3]
-                num_atom = np.sum(num_atoms)
-                masses = []
-                for n, m in zip(num_atoms, elem_masses):
-                    masses += [m] * n
-
-        # Get Hessian matrix (normalized by masses)
-        if element.tag == 'varray':
-            if element.attrib['name'] == 'hessian':
-                fc_tmp = []
-                for v in element.findall('./v'):
-                    fc_tmp.append([float(x) for x in v.text.strip().split()])
-
-    if fc_tmp is None:
+        if event == 'start':
+            stack.append(element)
+            if element.tag == 'array' and \
+               element.attrib.get('name') == 'atomtypes':
+                in_atomtypes = True
+            elif element.tag == 'varray' and \
+                    element.attrib.get('name') == 'hessian':
+                in_hessian = True
+                if masses is not None:
+                    hessian = np.zeros((len(masses) * 3,) * 2,
+                                       dtype='double')
+            continue
+
+        stack.pop()
+        if in_atomtypes:
+            if element.tag != 'array':
+                continue
+            in_atomtypes = False
+            num_atoms, elements, elem_masses = \
+                _get_atomtypes_from_vasprun_xml(element)
+            masses = np.repeat(elem_masses, num_atoms)
+        elif in_hessian and element.tag == 'v':
+            if hessian is not None and row < len(hessian):
+                values = np.fromstring(element.text, sep=" ")
+                if values.size != len(hessian):
+                    return False
+                hessian[row] = values
+            row += 1
+        elif element.tag == 'varray' and in_hessian:
+            in_hessian = False
+
+        # drop what has been read; the element is the last child
+        element.clear()
+        if stack and len(stack[-1]) and stack[-1][-1] is element:
+            del stack[-1][-1]
+
+    if hessian is None or row != len(hessian):
         return False
-    else:
-        fc_tmp = np.array(fc_tmp)
-        if fc_tmp.shape != (num_atom * 3, num_atom * 3):
-            return False
-        # num_atom = fc_tmp.shape[0] / 3
-        force_constants = np.zeros((num_atom, num_atom, 3, 3), dtype='double')
-
-        for i in range(num_atom):
-            for j in range(num_atom):
-                force_constants[i, j] = fc_tmp[i*3:(i+1)*3, j*3:(j+1)*3]
-
-        # Inverse normalization by atomic weights
-        for i in range(num_atom):
-            for j in range(num_atom):
-                force_constants[i, j] *= -np.sqrt(masses[i] * masses[j])
-
-        return force_constants, elements
-
-def _parse_vasprun_xml(filename):
-    if _is_version528(filename):
-        return _iterparse(VasprunWrapper(filename))
-    else:
-        return _iterparse(filename)
+
+    # Inverse normalization by atomic weights, -H_ij * sqrt(m_i m_j)
+    weights = np.sqrt(np.repeat(masses, 3))
+    hessian *= -weights[:, None]
+    hessian *= weights[None, :]
+    return hessian_to_fc(hessian), elements
+
+def _get_atomtypes_from_vasprun_xml(element):
+    # <array name="atomtypes"> rows: count, element, mass, valence, pseudo
+    num_atoms = []
+    elements = []
+    masses = []
+    for rc in element.iter('rc'):
+        columns = [c.text.strip() for c in rc.findall('c')]
+        num_atoms.append(int(columns[0]))
+        elements.append(columns[1])
+        masses.append(float(columns[2]))
+    return num_atoms, elements, masses
+
+def _parse_vasprun_xml(filename, sections=('atominfo', 'dynmat')):
+    return _iterparse(VasprunWrapper(filename, sections))
+
+class VasprunWrapper(object):
+    """File object over vasprun.xml for iterparse.
+
+    Only the root element and the given top-level sections are passed
+    on (all of it if sections is None), so the XML parser never sees
+    the ionic steps of a multi-GB file. The root is closed at the end
+    of the file even if VASP did not finish writing it, and the
+    PRECFOCK line that VASP 5.2.8 writes as invalid XML is replaced.
+    """
+
+    def __init__(self, filename, sections=None):
+        self._lines = self._filter(filename, sections)
+
+    def read(self, size=16384):
+        # whole lines, at least size characters unless the file ends
+        data = []
+        length = 0
+        for line in self._lines:
+            data.append(line)
+            length += len(line)
+            if length >= size:
+                break
+        return "".join(data)
+
+    def _filter(self, filename, sections):
+        # vasprun.xml declares ISO-8859-1, whatever the locale
+        inside = None
+        with open(filename, encoding="ISO-8859-1") as f:
+            for line in f:
+                yield line
+                if "<modeling" in line:
+                    break
+            for line in f:
+                if "</modeling>" in line:
+                    continue
+                if "PRECFOCK" in line:
+                    line = '<i type="string" name="PRECFOCK"></i>\n'
+                if sections is not None and inside is None:
+                    for section in sections:
+                        if "<" + section in line:
+                            inside = section
+                            break
+                    else:
+                        continue
+                if inside is not None and "</" + inside + ">" in line:
+                    inside = None
+                yield line
+        yield "</modeling>\n"
 
 def _iterparse(fname, tag=None):
-    try:
-        import xml.etree.cElementTree as etree
-        for event, elem in etree.iterparse(fname):
-            if tag is None or elem.tag == tag:
-                yield event, elem
-    except ImportError:
-        print("Python 2.5 or later is needed.")
-        print("For creating FORCE_SETS file with Python 2.4, you can use "
-              "phonopy 1.8.5.1 with python-lxml .")
-        sys.exit(1)
+    import xml.etree.ElementTree as etree
+    for event, elem in etree.iterparse(fname, events=('start', 'end')):
+        if tag is None or elem.tag == tag:
+            yield event, elem
+
+def main(argv):
+    # python phonopy_force_constants.py vasprun.xml [FORCE_CONSTANTS] [binary]
+    if len(argv) < 2:
+        sys.exit("Usage: %s vasprun.xml [FORCE_CONSTANTS] [binary]" % argv[0])
+    filename = argv[1]
+    output = argv[2] if len(argv) > 2 else "FORCE_CONSTANTS"
+    binary = len(argv) > 3 and argv[3] == "binary"
+    result = read_force_constant_vasprun_xml(filename)
+    if not result:
+        sys.exit("No Hessian matrix found in %s" % filename)
+    force_constants, elements = result
+    write_FORCE_CONSTANTS(force_constants, output, binary=binary)
+    print("Wrote %d x %d force constants (%s) to %s" %
+          (force_constants.shape[0], force_constants.shape[1],
+           " ".join(elements), output))
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -21,24 +21,29 @@
 #                                                                                                  #
 ####################################################################################################
 
+import os
 import sys
+import itertools
+import fnmatch
 import numpy
 
 def main():
 
-    # get things from POSCAR
+    # batch format conversion of many POSCAR files
+    if len(sys.argv) > 1 and sys.argv[1] == "convert":
+        batchconvert(sys.argv[2:])
+        return
+
+    # transform every frame of a trajectory or directory of POSCARs
+    if len(sys.argv) > 4 and sys.argv[1] == "stream":
+        streamframes(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5:])
+        return
+
+    # get things from POSCAR (parsed once)
     welcome()
-    pos = getcasesandT()[0]
-    icase = getcasesandT()[1]
-    T = getcasesandT()[2]
-    data = getinfofromfile()[0]
-    datasplit = getinfofromfile()[1]
-    latconstant = getinfofromfile()[2]
-    unit_lattice = getinfofromfile()[3]
-    volume = getinfofromfile()[4]
-    inverse_lattice = getinfofromfile()[5]
-    line_at = checkstyle(datasplit)[0]
-    istyle = checkstyle(datasplit)[1]
+    pos, icase, T = getcasesandT()
+    data, datasplit, latconstant, unit_lattice, volume, inverse_lattice = getinfofromfile()
+    line_at, istyle = checkstyle(datasplit)
     iformat = checkformat(line_at,datasplit)
 
     # case 0: print volume
@@ -47,7 +52,7 @@ def main():
 
     # case 1: covert between direct and cartesian
     if icase == 1:
-        icase1(iformat, data, datasplit, line_at, unit_lattice, inverse_lattice)
+        icase1(iformat, data, datasplit, line_at, unit_lattice)
 
     # case 2: determine the new volume size
     if icase == 2:
@@ -64,8 +69,10 @@ def welcome():
            " and/or transform POSCAR file in the DIRECT format")
     return 1
 
-def getcasesandT():
-    pos = [float(i) for i in sys.argv[2:]]
+def getcasesandT(args=None):
+    if args is None:
+        args = sys.argv[2:]
+    pos = [float(i) for i in args]
     dimT = len(pos)
     if dimT == 0:
         icase = 0
@@ -90,8 +97,10 @@ def getcasesandT():
         sys.exit("I don't understand the request for the supercell size.")
     return pos, icase, T
 
-def getinfofromfile():
-    data = open(sys.argv[1], "r").readlines()
+def getinfofromfile(filename=None):
+    if filename is None:
+        filename = sys.argv[1]
+    data = open(filename, "r").readlines()
     datasplit = [i.rsplit() for i in data]
     latconstant = float(datasplit[1][0])
     unit_lattice = numpy.array([[float(j) for j in datasplit[i]] for i in range(2, 5)])
@@ -156,42 +165,58 @@ def icase0(volume):
     print (40 * "-")
     sys.exit()
 
-def icase1(iformat,data,datasplit,line_at,unit_lattice,inverse_lattice):
+def icase1(iformat,data,datasplit,line_at,unit_lattice):
+    atom_pos = numpy.array([i for i in datasplit[line_at + 1:] if len(i) == 3], dtype=float).reshape(-1, 3)
     if iformat == 1:
-        dir_output = open("supercell_direct.dat", "w")
-        for i in data:
-            dir_output.write(i)
-        dir_output.close()
-        car_output = open("supercell_cartesian.dat", "w")
-        for i in range(line_at):
-            car_output.write(data[i])
-        car_output.write("Cartesian\n")
-        atom_pos = numpy.array([[float(j) for j in i] for i in datasplit[line_at + 1:] if len(i) == 3])
-        for i in atom_pos:
-            cart_atom_pos = V2A(unit_lattice, *i)
-            car_output.write("   {:16.15f}   {:16.15f}   {:16.15f}\n".format(*cart_atom_pos))
-        car_output.close()
-        print ("\n  Program Finished ...  \n")
-        print (40 * "-")
-        sys.exit()
+        same, other, header = "supercell_direct.dat", "supercell_cartesian.dat", "Cartesian\n"
+    else:
+        same, other, header = "supercell_cartesian.dat", "supercell_direct.dat", "Direct\n"
+    output = open(same, "w")
+    output.writelines(data)
+    output.close()
+    output = open(other, "w")
+    output.writelines(data[:line_at])
+    output.write(header)
+    writepositions(output, convertpositions(atom_pos, unit_lattice, tocartesian=(iformat == 1)))
+    output.close()
+    print ("\n  Program Finished ...  \n")
+    print (40 * "-")
+    sys.exit()
 
-    if iformat == 2:
-        car_output = open("supercell_cartesian.dat", "w")
-        for i in data:
-            car_output.write(i)
-        car_output.close()
-        dir_output = open("supercell_direct.dat", "w")
-        for i in range(line_at):
-            dir_output.write(data[i])
-        dir_output.write("Direct\n")
-        atom_pos = numpy.array([[float(j) for j in i] for i in datasplit[line_at + 1:] if len(i) == 3])
-        for i in atom_pos:
-            dir_atom_pos = V2A(inverse_lattice, *i)
-            dir_output.write("   {:16.15f}   {:16.15f}   {:16.15f}\n".format(*dir_atom_pos))
-        dir_output.close()
-        print ("\n  Program Finished ...  \n")
-        print (40 * "-")
-        sys.exit()
+def convertpositions(positions,lattice,tocartesian,wrap=False):
+    # all atoms at once: cartesian = direct.dot(lattice), direct = solve
+    positions = numpy.asarray(positions, dtype=float)
+    lattice = numpy.asarray(lattice, dtype=float)
+    if tocartesian:
+        if wrap:
+            positions = positions % 1.0
+        return positions.dot(lattice)
+    direct = numpy.linalg.solve(lattice.T, positions.T).T
+    if wrap:
+        direct = direct % 1.0
+    return direct
+
+def batchconvert(args):
+    # python3 poscar_gen.py convert direct|cartesian [wrap] POSCAR1 POSCAR2 ...
+    if len(args) < 2 or args[0].lower() not in ("direct", "cartesian"):
+        sys.exit("Usage: poscar_gen.py convert direct|cartesian [wrap] POSCAR ...")
+    target = args[0].lower()
+    files = args[1:]
+    wrap = files[0].lower() == "wrap"
+    if wrap:
+        files = files[1:]
+    for filename in files:
+        poscar = Poscar.from_file(filename)
+        if wrap:
+            poscar = poscar.wrapped()
+        if target == "cartesian":
+            poscar = poscar.to_cartesian()
+        else:
+            poscar = poscar.to_direct()
+        poscar.write(filename + "." + target)
+        print ("  {} -> {}".format(filename, filename + "." + target))
+    print ("\n  Program Finished ...  \n")
+    print (40 * "-")
 
 def icase2(pos,volume,latconstant,data):
     newvolume = -1 * pos[0]
@@ -212,13 +237,17 @@ def icase2(pos,volume,latconstant,data):
 def icasegt2(T,line_at,datasplit,data):
     R = T2R(T)
     nsuper = getnsuper(T)
-    outputtopoffile(line_at, datasplit, nsuper, data, T)
+    output = open("supercell.dat", "w")
+    outputtopoffile(output, line_at, datasplit, nsuper, data, T)
     lattice = getnewunitvectors(nsuper, R)
-    outputbottomoffile(data, line_at, nsuper, lattice, R)
+    outputbottomoffile(output, data, line_at, nsuper, lattice, R)
+    output.close()
+    print ("\n  Program Finished ...  \n")
+    print (40 * "-")
     sys.exit()
 
 def getnsuper(T):
-    nsuper = int(numpy.linalg.det(T))
+    nsuper = int(round(numpy.linalg.det(T)))
     if nsuper < 1:
         print ("")
         print ("  " + str(T))
@@ -228,8 +257,7 @@ def getnsuper(T):
         sys.exit()
     return nsuper
 
-def outputtopoffile(line_at,datasplit,nsuper,data,T):
-    output = open("supercell.dat", "w")
+def outputtopoffile(output,line_at,datasplit,nsuper,data,T):
     for i in range(line_at):
         if i < 2:
             output.write(data[i])
@@ -243,35 +271,280 @@ def outputtopoffile(line_at,datasplit,nsuper,data,T):
             row = [str(int(int(j) * nsuper)) for j in datasplit[i]]
             output.write("   " + " ".join(row) + "\n")
     output.write(data[line_at])
-    output.close()
     return 1
 
-def outputbottomoffile(data,line_at,nsuper,lattice,R):
-    output = open("supercell.dat","a")
+# above this many atoms the supercell positions are streamed in chunks
+STREAM_ATOMS = 2 ** 22
+
+def outputbottomoffile(output,data,line_at,nsuper,lattice,R,chunk=None):
     unitvec = numpy.array([[float(j) for j in i.rsplit()] for i in data[line_at + 1:]])
-    for i in unitvec:
-        vec = i.dot(R) / nsuper
-        for j in lattice:
-            newunitvec = vec + j
-            output.write("   {:16.15f}   {:16.15f}   {:16.15f}\n".format(*newunitvec))
-    output.close()
-    print ("\n  Program Finished ...  \n")
-    print (40 * "-")
+    vec = unitvec.dot(R) / nsuper
+    if chunk is None and len(vec) * len(lattice) > STREAM_ATOMS:
+        chunk = STREAM_ATOMS
+    if chunk is None:
+        # every basis atom shifted by every translation, basis atom outermost
+        positions = (vec[:, None, :] + lattice[None, :, :]).reshape(-1, 3)
+        writepositions(output, positions)
+    else:
+        for i in vec:
+            for start in range(0, len(lattice), chunk):
+                writepositions(output, i + lattice[start:start + chunk])
+
+def writepositions(output,positions,chunk=2 ** 16):
+    # one % per block of rows instead of one format per atom
+    row = "   %16.15f   %16.15f   %16.15f\n"
+    for start in range(0, len(positions), chunk):
+        block = positions[start:start + chunk]
+        output.write((row * len(block)) % tuple(block.ravel()))
 
 def getnewunitvectors(nsuper,R):
-    nfind = 0
-    lattice = []
-    for i in range(-50, 50):
-        for j in range(-50, 50):
-            for k in range(-50, 50):
-                vec = numpy.array([k, j, i]).dot(R)
-                if vec[0] >= 0 and vec[0] < nsuper and vec[1] >= 0 and vec[1] < nsuper and vec[2] >= 0 and vec[2] < nsuper:
-                    nfind += 1
-                    vec = vec / nsuper
-                    lattice.append(vec)
-    lattice = numpy.array(lattice)
+    # Every translation n (integer, in units of the old lattice) with
+    # 0 <= n.R < nsuper in all three components. These are the points of
+    # the lattice spanned by the rows of R inside a cube of side nsuper;
+    # there are exactly det(T) = nsuper of them, so they are enumerated
+    # straight from the Hermite normal form of R instead of searching.
+    if not numpy.allclose(R, numpy.rint(R)):
+        sys.exit("The T matrix must have integer entries.")
+    R = numpy.rint(R).astype(numpy.int64)
+    H = hermitenormalform(R)
+    c0 = numpy.arange(0, (nsuper - 1) // H[0][0] + 1)
+    owner, c1 = rangesbetween(-c0 * H[0][1], nsuper - 1 - c0 * H[0][1], H[1][1])
+    c0 = c0[owner]
+    base = c0 * H[0][2] + c1 * H[1][2]
+    owner, c2 = rangesbetween(-base, nsuper - 1 - base, H[2][2])
+    points = numpy.column_stack((c0[owner], c1[owner], c2)).dot(H)
+
+    # keep the order of the old (i, j, k) search: n[2], then n[1], then n[0]
+    n = numpy.rint(points.dot(numpy.linalg.inv(R)))
+    order = numpy.lexsort((n[:, 0], n[:, 1], n[:, 2]))
+    lattice = points[order] / nsuper
     return lattice
 
+def hermitenormalform(M):
+    # upper triangular basis (positive diagonal) of the lattice spanned by the rows of M
+    H = [[int(j) for j in i] for i in M]
+    for col in range(3):
+        while True:
+            rows = [i for i in range(col, 3) if H[i][col] != 0]
+            if len(rows) == 0:
+                sys.exit("The T matrix is singular.")
+            pivot = min(rows, key=lambda i: abs(H[i][col]))
+            H[col], H[pivot] = H[pivot], H[col]
+            done = True
+            for i in range(col + 1, 3):
+                q = H[i][col] // H[col][col]
+                H[i] = [a - q * b for a, b in zip(H[i], H[col])]
+                if H[i][col] != 0:
+                    done = False
+            if done:
+                break
+        if H[col][col] < 0:
+            H[col] = [-a for a in H[col]]
+    return numpy.array(H, dtype=numpy.int64)
+
+def rangesbetween(lo, hi, step):
+    # all integers c with lo <= c*step <= hi, for every (lo, hi) pair;
+    # returns the index of the pair each c came from and c itself
+    first = -((-lo) // step)
+    last = hi // step
+    counts = numpy.maximum(last - first + 1, 0)
+    owner = numpy.repeat(numpy.arange(len(counts)), counts)
+    offsets = numpy.arange(owner.size) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    return owner, first[owner] + offsets
+
+class Poscar:
+    """A POSCAR parsed once, for use from other Python code.
+
+    lattice     (3, 3) unit vectors as rows, unscaled as in the file
+    scale       lattice constant (second line)
+    species     element names, or None for the old style without them
+    counts      atoms of each species
+    positions   (n_atoms, 3) fractional (direct) coordinates
+    cartesian   write positions as Cartesian instead of Direct
+
+    Cartesian coordinates are in the units of the POSCAR Cartesian block,
+    positions.dot(lattice), which VASP then multiplies by scale. Methods
+    return new Poscar objects and never exit.
+    """
+
+    def __init__(self, comment, scale, lattice, species, counts, positions, cartesian=False):
+        self.comment = comment
+        self.scale = float(scale)
+        self.lattice = numpy.array(lattice, dtype=float).reshape(3, 3)
+        self.species = None if species is None else list(species)
+        self.counts = numpy.array(counts, dtype=int)
+        self.positions = numpy.array(positions, dtype=float).reshape(-1, 3)
+        self.cartesian = cartesian
+
+    @classmethod
+    def from_file(cls, filename):
+        with open(filename, "r") as f:
+            return cls.from_lines(f.readlines())
+
+    @classmethod
+    def from_lines(cls, data):
+        datasplit = [i.split() for i in data]
+        line_at, istyle = checkstyle(datasplit)
+        species = datasplit[5] if istyle == 2 else None
+        counts = [int(i) for i in datasplit[line_at - 1]]
+        if datasplit[line_at][0].lower().startswith("s"):
+            line_at += 1  # selective dynamics
+        style = datasplit[line_at][0].lower()
+        if "d" in style:
+            iformat = 1
+        elif "c" in style:
+            iformat = 2
+        else:
+            raise ValueError("Cannot tell the form, either Direct or Cartesian.")
+        natoms = sum(counts)
+        positions = numpy.loadtxt(data[line_at + 1:line_at + 1 + natoms], usecols=(0, 1, 2), ndmin=2)
+        lattice = numpy.array([[float(j) for j in datasplit[i][:3]] for i in range(2, 5)])
+        if iformat == 2:
+            positions = convertpositions(positions, lattice, tocartesian=False)
+        return cls(data[0].rstrip("\n"), float(datasplit[1][0]), lattice, species,
+                   counts, positions, cartesian=(iformat == 2))
+
+    def copy(self, **changes):
+        values = dict(comment=self.comment, scale=self.scale, lattice=self.lattice,
+                      species=self.species, counts=self.counts,
+                      positions=self.positions, cartesian=self.cartesian)
+        values.update(changes)
+        return Poscar(**values)
+
+    @property
+    def natoms(self):
+        return int(self.counts.sum())
+
+    @property
+    def volume(self):
+        return numpy.linalg.det(self.lattice) * self.scale ** 3
+
+    def cartesian_positions(self):
+        return convertpositions(self.positions, self.lattice, tocartesian=True)
+
+    def wrapped(self):
+        return self.copy(positions=self.positions % 1.0)
+
+    def to_direct(self):
+        return self.copy(cartesian=False)
+
+    def to_cartesian(self):
+        return self.copy(cartesian=True)
+
+    def rescale(self, volume):
+        ratio = (volume / self.volume) ** (1 / 3)
+        return self.copy(comment="Modified POSCAR. Volume = {}".format(volume),
+                         scale=ratio * self.scale)
+
+    def supercell(self, T, translations=None):
+        # T is a 3x3 matrix, or 1 or 3 numbers for a diagonal one
+        T = getT(T)
+        R = T2R(T)
+        nsuper = int(round(numpy.linalg.det(T)))
+        if nsuper < 1:
+            raise ValueError("Wrong T matrix, determinant = {}".format(nsuper))
+        if translations is None:
+            translations = getnewunitvectors(nsuper, R)
+        vec = self.positions.dot(R) / nsuper
+        positions = (vec[:, None, :] + translations[None, :, :]).reshape(-1, 3)
+        return self.copy(lattice=self.lattice.dot(T), counts=self.counts * nsuper,
+                         positions=positions)
+
+    def lines(self):
+        out = [self.comment + "\n", "  {}\n".format(self.scale)]
+        for i in self.lattice:
+            out.append("   {:.15f}  {:.15f}  {:.15f}\n".format(*i))
+        if self.species is not None:
+            out.append("   " + " ".join(self.species) + "\n")
+        out.append("   " + " ".join(str(i) for i in self.counts) + "\n")
+        out.append("Cartesian\n" if self.cartesian else "Direct\n")
+        return out
+
+    def write(self, output):
+        # output is a file name or an open file
+        if isinstance(output, str):
+            with open(output, "w") as f:
+                return self.write(f)
+        output.writelines(self.lines())
+        if self.cartesian:
+            writepositions(output, self.cartesian_positions())
+        else:
+            writepositions(output, self.positions)
+
+def getT(T):
+    T = numpy.array(T, dtype=float)
+    if T.size == 1:
+        return pos1toT(T.ravel())
+    if T.size == 3:
+        return pos3toT(T.ravel())
+    return T.reshape(3, 3)
+
+# names read from a directory by readframes
+FRAME_PATTERNS = ("POSCAR*", "CONTCAR*", "XDATCAR*", "*.vasp")
+
+def readframes(path, exclude=None):
+    # Poscar frames one at a time from a POSCAR, a file of concatenated
+    # POSCARs, an XDATCAR (fixed or variable cell) or a directory of them;
+    # in a directory only FRAME_PATTERNS files are read, never exclude
+    if os.path.isdir(path):
+        exclude = os.path.realpath(exclude) if exclude is not None else None
+        for name in sorted(os.listdir(path)):
+            filename = os.path.join(path, name)
+            if not os.path.isfile(filename) or os.path.realpath(filename) == exclude:
+                continue
+            if any(fnmatch.fnmatch(name, pattern) for pattern in FRAME_PATTERNS):
+                for frame in readframes(filename):
+                    yield frame
+        return
+    with open(path, "r") as f:
+        lines = iter(f)
+        header = None
+        for line in lines:
+            if not line.strip():
+                continue
+            if header is None or "configuration" not in line.lower():
+                # a new header: comment, scale, lattice, [species], counts
+                header = [line] + list(itertools.islice(lines, 5))
+                if not header[-1].split()[0].isdigit():
+                    header += list(itertools.islice(lines, 1))
+                line = next(lines)
+            if line.split()[0].lower().startswith("s"):
+                line = next(lines)  # selective dynamics
+            natoms = sum(int(i) for i in header[-1].split())
+            body = list(itertools.islice(lines, natoms))
+            style = "Direct\n" if "d" in line.split()[0].lower() else "Cartesian\n"
+            yield Poscar.from_lines(header + [style] + body)
+
+def streamframes(source, destination, operation, args):
+    # python3 poscar_gen.py stream SOURCE DESTINATION volume V
+    #                                                  direct | cartesian
+    #                                                  supercell n | n1 n2 n3 | T11 ... T33
+    # Frames are read, transformed and appended to DESTINATION one at a
+    # time; the supercell translations are computed once for all frames.
+    if operation == "supercell":
+        T = getT([float(i) for i in args])
+        nsuper = getnsuper(T)
+        translations = getnewunitvectors(nsuper, T2R(T))
+    output = open(destination, "w")
+    nframes = 0
+    for frame in readframes(source, exclude=destination):
+        if operation == "volume":
+            frame = frame.rescale(float(args[0]))
+        elif operation == "direct":
+            frame = frame.to_direct()
+        elif operation == "cartesian":
+            frame = frame.to_cartesian()
+        elif operation == "supercell":
+            frame = frame.supercell(T, translations)
+        else:
+            sys.exit("I don't understand the operation '{}'.".format(operation))
+        frame.write(output)
+        nframes += 1
+    output.close()
+    print ("  {} frames written to {}".format(nframes, destination))
+    print ("\n  Program Finished ...  \n")
+    print (40 * "-")
+
 ##################################
 
 if __name__ == '__main__':
@@ -0,0 +1,207 @@
+###############################################
+#
+#    script: sparse_solver.py
+#
+#    Author: Paul Sanders (phs0007@auburn.edu)
+#
+#    Purpose: Load (i, j, value) dynamical matrix
+#             files as sparse matrices and find the
+#             full spectrum without a dense array
+#
+#    Solvers: "circulant" - periodic chain with the same
+#                           couplings on every site, the
+#                           spectrum is an FFT of one row
+#             "banded"    - bandwidth reduced with reverse
+#                           Cuthill-McKee, then a banded
+#                           (or tridiagonal) eigen-solver,
+#                           O(N**2) time but O(N) memory
+#             "dense"     - everything else
+#
+#    lowest_eigvalsh finds only the bottom of the spectrum
+#    (lowest k, or everything below a value) with
+#    shift-invert Lanczos, checked against the inertia
+#    (number of negative pivots) of array - value * I.
+#
+###############################################
+
+import numpy
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.sparse.linalg
+
+def get_sparse_array(file):
+    data = open(file, "r")
+    length = int(data.readline().split()[0])
+    triplets = numpy.loadtxt(data, ndmin=2)
+    data.close()
+    rows = triplets[:, 0].astype(numpy.int64) - 1
+    cols = triplets[:, 1].astype(numpy.int64) - 1
+    values = triplets[:, 2]
+
+    # like get_array, the last entry given for (i, j) or (j, i) wins
+    lo = numpy.minimum(rows, cols)
+    hi = numpy.maximum(rows, cols)
+    keys = lo * length + hi
+    keys, last = numpy.unique(keys[::-1], return_index=True)
+    last = len(values) - 1 - last
+    lo, hi, values = lo[last], hi[last], values[last]
+
+    off = lo != hi
+    rows = numpy.concatenate((lo, hi[off]))
+    cols = numpy.concatenate((hi, lo[off]))
+    values = numpy.concatenate((values, values[off]))
+    array = scipy.sparse.csr_matrix((values, (rows, cols)), shape=(length, length))
+    return length, array
+
+def symmetrize(array, report=False):
+    # symmetric part of a dense or sparse matrix with the sum rule
+    # sum_j A_ij = 0 restored on the diagonal, which keeps the sparsity
+    if scipy.sparse.issparse(array):
+        array = scipy.sparse.csr_matrix(array)
+        symmetric = (array + array.T) * 0.5
+        rows = numpy.asarray(symmetric.sum(axis=1)).ravel()
+        result = (symmetric - scipy.sparse.diags(rows)).tocsr()
+        asymmetry = numpy.amax(numpy.abs((symmetric - array).data), initial=0)
+        scale = numpy.amax(numpy.abs(array.data), initial=0)
+    else:
+        array = numpy.asarray(array, dtype=float)
+        symmetric = (array + array.T) * 0.5
+        rows = symmetric.sum(axis=1)
+        result = symmetric - numpy.diag(rows)
+        asymmetry = numpy.amax(numpy.abs(symmetric - array), initial=0)
+        scale = numpy.amax(numpy.abs(array), initial=0)
+    if report:
+        print("Symmetrized matrix: largest change {:.3e} (symmetry) and {:.3e} "
+              "(sum rule), largest |A| {:.3e}".format(
+                  asymmetry, numpy.amax(numpy.abs(rows), initial=0), scale))
+    return result
+
+def circulant_row(array, tol=1e-12):
+    # returns the first row if every row is the first row shifted by one site
+    array = scipy.sparse.coo_matrix(array)
+    length = array.shape[0]
+    offsets = (array.col - array.row) % length
+    row = numpy.zeros(length)
+    count = numpy.zeros(length, dtype=numpy.int64)
+    numpy.add.at(count, offsets, 1)
+    row[offsets] = array.data
+    if numpy.any((count != 0) & (count != length)):
+        return None
+    scale = numpy.amax(numpy.abs(array.data), initial=1)
+    if numpy.amax(numpy.abs(array.data - row[offsets]), initial=0) > tol * scale:
+        return None
+    return row
+
+def bandwidth(array):
+    array = scipy.sparse.coo_matrix(array)
+    if array.nnz == 0:
+        return 0
+    return int(numpy.amax(numpy.abs(array.row - array.col)))
+
+def to_banded(array, band):
+    # lower form used by scipy.linalg.eigvals_banded
+    array = scipy.sparse.coo_matrix(array)
+    keep = (array.row >= array.col) & (array.row - array.col <= band)
+    ab = numpy.zeros((band + 1, array.shape[0]))
+    ab[array.row[keep] - array.col[keep], array.col[keep]] = array.data[keep]
+    return ab
+
+def choose_solver(array, max_band=64):
+    if circulant_row(array) is not None:
+        return "circulant"
+    array = scipy.sparse.csr_matrix(array)
+    perm = scipy.sparse.csgraph.reverse_cuthill_mckee(array, symmetric_mode=True)
+    if bandwidth(array[perm][:, perm]) <= max_band:
+        return "banded"
+    return "dense"
+
+def eigvalsh(array, solver=None, max_band=64):
+    if solver is None:
+        solver = choose_solver(array, max_band)
+
+    if solver == "circulant":
+        row = circulant_row(array)
+        if row is None:
+            raise ValueError("Matrix is not circulant")
+        eigens = numpy.sort(numpy.fft.fft(row).real)
+    elif solver == "banded":
+        array = scipy.sparse.csr_matrix(array)
+        perm = scipy.sparse.csgraph.reverse_cuthill_mckee(array, symmetric_mode=True)
+        array = array[perm][:, perm]
+        band = bandwidth(array)
+        if band <= 1:
+            diagonal = array.diagonal()
+            offdiagonal = array.diagonal(-1)
+            if len(offdiagonal) == 0:
+                eigens = numpy.sort(diagonal)
+            else:
+                eigens = scipy.linalg.eigvalsh_tridiagonal(diagonal, offdiagonal)
+        else:
+            eigens = scipy.linalg.eigvals_banded(to_banded(array, band), lower=True)
+    elif solver == "dense":
+        eigens = scipy.linalg.eigvalsh(scipy.sparse.csr_matrix(array).toarray())
+    else:
+        raise ValueError("Unknown solver '{}'".format(solver))
+    return eigens
+
+def lowest_eigvalsh(array, k=None, max_value=None, tol=0, margin=8, seed=0):
+    # lowest k eigenvalues, or all of them below max_value, with
+    # shift-invert Lanczos about a point just below the Gershgorin lower
+    # bound. margin extra modes are found so the ones kept are converged,
+    # the cut never splits a (near-)degenerate group, and the count is
+    # checked against inertia(); the dense solver takes over when they
+    # disagree
+    array = scipy.sparse.csc_matrix(array)
+    length = array.shape[0]
+    diagonal = array.diagonal()
+    radius = numpy.asarray(abs(array).sum(axis=1)).ravel() - numpy.abs(diagonal)
+    lower = numpy.amin(diagonal - radius)
+    scale = max(numpy.amax(numpy.abs(diagonal)), 1)
+    shift = lower - 1e-3 * scale
+    v0 = numpy.random.default_rng(seed).standard_normal(length)
+    want = k or 32
+    while True:
+        if want + margin >= length - 1:
+            return _lowest(scipy.linalg.eigvalsh(array.toarray()), k, max_value, scale)
+        eigens = numpy.sort(scipy.sparse.linalg.eigsh(
+            array, want + margin, sigma=shift, which="LM", tol=tol, v0=v0,
+            return_eigenvectors=False))
+        if max_value is None or eigens[-margin] > max_value:
+            break
+        want *= 2
+    found = _lowest(eigens, k, max_value, scale)
+    if max_value is not None:
+        cut = max_value
+    else:
+        cut = 0.5 * (eigens[len(found) - 1] + eigens[len(found)])
+    count = inertia(array, cut)
+    if count is not None and count != len(found):
+        return _lowest(scipy.linalg.eigvalsh(array.toarray()), k, max_value, scale)
+    return found
+
+def _lowest(eigens, k, max_value, scale, gap=1e-6):
+    # sorted eigens cut at max_value, or after the k-th one and the rest
+    # of its (near-)degenerate group
+    if max_value is not None:
+        return eigens[eigens <= max_value]
+    count = min(k, len(eigens))
+    while 0 < count < len(eigens) and eigens[count] - eigens[count - 1] <= gap * scale:
+        count += 1
+    return eigens[:count]
+
+def inertia(array, value):
+    # number of eigenvalues below value (Sylvester's law of inertia) from
+    # a symmetric LDL^T-like factorization of array - value * I: SuperLU
+    # with diagonal pivots, whose U has D on its diagonal. None when it had
+    # to pivot off the diagonal or value is an eigenvalue
+    shifted = scipy.sparse.csc_matrix(
+        array - value * scipy.sparse.identity(array.shape[0], format="csc"))
+    try:
+        lu = scipy.sparse.linalg.splu(shifted, diag_pivot_thresh=0,
+                                      options=dict(SymmetricMode=True))
+    except RuntimeError:
+        return None
+    if not numpy.array_equal(lu.perm_r, lu.perm_c):
+        return None
+    return int(numpy.sum(lu.U.diagonal() < 0))
@@ -15,6 +15,7 @@
 
 import sys
 import numpy
+import phonon_thermodynamics
 
 """
 density_of_states = import_data(sys.argv[1])
@@ -36,31 +37,27 @@ def import_data(file):
     return dosvalues
 
 def get_free_energy(temp, density_of_states):
-    hbar = 1
-    kb = 1
-    free_energy = 0
-    for i in density_of_states:
-        omega = i[0]
-        density = i[1]
-        x = hbar * omega / ( kb * temp ) 
-        log_arg = 1 - numpy.exp(-x)
-        free_energy = free_energy + density * (hbar * omega * 0.5 + kb * temp * numpy.log(log_arg))
-    return free_energy
+    return phonon_thermodynamics.from_dos(temp, density_of_states)[0]
 
 def get_energy(temp, density_of_states):
-    hbar = 1
-    kb = 1
-    energy = 0
-    for i in density_of_states:
-        omega = i[0]
-        density = i[1]
-        x = hbar * omega / ( kb * temp ) 
-        if x > 1 * 10 ^ 30:
-            n = 0
-        else:
-            n = 1 / (numpy.exp(x) - 1)
-        energy = energy + density * (hbar * omega * 0.5 + n)
-    return energy
+    return phonon_thermodynamics.from_dos(temp, density_of_states)[1]
+
+def get_entropy(temp, free_energy, energy):
+    temp = numpy.asarray(temp, dtype=float)
+    entropy = numpy.zeros(numpy.shape(temp))
+    hot = temp > 0
+    entropy[hot] = (numpy.asarray(energy)[hot] - numpy.asarray(free_energy)[hot]) / temp[hot]
+    return entropy
+
+def get_heat_capacity(temp, density_of_states):
+    return phonon_thermodynamics.from_dos(temp, density_of_states)[3]
+
+def output_results(temp, free_energy, energy, entropy):
+    output = open("thermodynamics.out","w")
+    output.write("# T F E S\n")
+    for i, value in enumerate(temp):
+        output.write("{:10.3f} {:20.10f} {:20.10f} {:20.10f}\n".format(value, free_energy[i], energy[i], entropy[i]))
+    output.close()
 
 
 
@@ -17,6 +17,7 @@ import sys
 import numpy
 import scipy.linalg
 import matplotlib.pyplot as plt
+import phonopy_force_constants
 
 def main():
     length, array = get_array(sys.argv[1])
@@ -42,37 +43,9 @@ def main():
 ###############################################
 
 def get_array(file):
-    data = open(file,"r")
-    data = data.readlines()
-    data = [i.split() for i in data]
-    dynam_data = data[1:]
-    print(dynam_data)
-
-    # convert to float/int
-    for i, value in enumerate(dynam_data):
-        if i % 4 == 0:
-            for j, value2 in enumerate(value):
-                dynam_data[i][j] = int(dynam_data[i][j])
-        else:
-            for j, value2 in enumerate(value):
-                dynam_data[i][j] = float(dynam_data[i][j])
-
-    
-    length = int(data[0][0])*3
-    matrix_positions = dynam_data[::4]
-
-    # populate array
-    array = numpy.zeros((length,length))
-    for i, value in enumerate(matrix_positions):      
-        populate_array(value,dynam_data[4*i+1:4*(i+1)],array)
-
-    return length, array
-    
-def populate_array(element, values, array):
-    for i in range(3):
-        for j in range(3):
-            array[(element[0]-1)*3 + i][(element[1]-1)*3 + j] = values[i][j]
-    return True
+    force_constants = phonopy_force_constants.load_FORCE_CONSTANTS(file)
+    array = phonopy_force_constants.fc_to_hessian(force_constants)
+    return len(array), array
 
 def eigens(array):
     eigens = scipy.linalg.eigvalsh(array)